@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+
+from utils.encryption import SECRET_KEY
+from utils.crypto import calculate_checksum, encrypt_data, decrypt_data, encrypt_batch, decrypt_batch, seal, open_sealed
+
+# Messages/sec on one core for each way of sealing and opening a reading.
+#
+# Run from the src directory:
+#   python3 -m benchmarks.crypto --count 20000
+
+
+def make_reading(i):
+    return {
+        "Message Order": i,
+        "datetime": "2024-11-18 23:52:38",
+        "device_name": "BirdTrackerDevice42",
+        "latitude": 53.3437967,
+        "longitude": -6.2571465,
+        "heart_rate": 312.5,
+        "body_temperature": 41.2,
+        "timestamp": time.time(),
+        "source_ip": "10.35.70.20",
+        "source_port": 33801,
+        "height": 1200.0,
+        "restored": False,
+    }
+
+
+def legacy_round_trip(data, key):
+    #the per-class code before utils/crypto.py: new Cipher per call plus checksum
+    data = dict(data)
+    data["checksum"] = hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+    iv = os.urandom(12)
+    encryptor = Cipher(algorithms.AES(key), modes.GCM(iv), backend=default_backend()).encryptor()
+    ciphertext = encryptor.update(json.dumps(data).encode("utf-8")) + encryptor.finalize()
+    tag = encryptor.tag
+
+    decryptor = Cipher(algorithms.AES(key), modes.GCM(iv, tag), backend=default_backend()).decryptor()
+    received = json.loads((decryptor.update(ciphertext) + decryptor.finalize()).decode("utf-8"))
+    received_checksum = received.pop("checksum")
+    assert received_checksum == calculate_checksum(received)
+
+
+def cached_round_trip(data, key):
+    open_sealed(seal(dict(data), key, checksum=True), key)
+
+
+def tag_only_round_trip(data, key):
+    open_sealed(seal(dict(data), key, checksum=False), key)
+
+
+def raw_round_trip(data, key):
+    iv, tag, ciphertext = encrypt_data(data, key)
+    decrypt_data(iv, ciphertext, tag, key)
+
+
+def measure(fn, readings, key):
+    start = time.perf_counter()
+    for data in readings:
+        fn(data, key)
+    return len(readings) / (time.perf_counter() - start)
+
+
+def measure_batch(readings, key, batch_size):
+    start = time.perf_counter()
+    for i in range(0, len(readings), batch_size):
+        iv, tag, ciphertext = encrypt_batch(readings[i:i + batch_size], key)
+        decrypt_batch(iv, ciphertext, tag, key)
+    return len(readings) / (time.perf_counter() - start)
+
+
+def main(count, batch_size):
+    readings = [make_reading(i) for i in range(count)]
+    results = [
+        ("legacy Cipher + checksum", measure(legacy_round_trip, readings, SECRET_KEY)),
+        ("cached AESGCM + checksum", measure(cached_round_trip, readings, SECRET_KEY)),
+        ("cached AESGCM, tag only", measure(tag_only_round_trip, readings, SECRET_KEY)),
+        ("cached AESGCM, no envelope", measure(raw_round_trip, readings, SECRET_KEY)),
+        (f"batch of {batch_size}, tag only", measure_batch(readings, SECRET_KEY, batch_size)),
+    ]
+
+    print(f"Encrypt + decrypt round trips, {count} readings, one core")
+    print(f"{'mode':<32}{'msgs/sec':>12}{'vs legacy':>12}")
+    for name, rate in results:
+        print(f"{name:<32}{rate:>12.0f}{rate / results[0][1]:>11.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crypto layer microbenchmark")
+    parser.add_argument('--count', type=int, default=20000, help="Number of readings")
+    parser.add_argument('--batch-size', type=int, default=64, help="Readings per encrypt_batch call")
+    args = parser.parse_args()
+
+    main(args.count, args.batch_size)
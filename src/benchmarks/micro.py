@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import time
+import math
+import random
+import argparse
+import platform
+
+from utils.encryption import SECRET_KEY
+from utils.crypto import calculate_checksum, encrypt_data, decrypt_data
+from utils.constellation import ConstellationView
+from utils.routing import RoutingEngine
+from utils.trace import start_trace
+from utils.simulation.satellite_emulator import SatelliteEmulator
+from utils.simulation.wildlife_tracker import WildLifeTracker
+from benchmarks.crypto import make_reading
+
+# Microbenchmarks for the functions that run on every message at every hop:
+# orbit propagation, the distance formulas, the checksum and AES-GCM, and the
+# next hop search over constellations of 10 to 10,000 satellites, both the
+# scalar reference loop and the NumPy/KD-tree versions used by default, and
+# the routing table lookup.
+#
+# Each case is timed in several interleaved rounds, relative to a fixed
+# reference loop measured right before it, which cancels most of the drift of
+# a shared or throttled machine. A case reports the median of its rounds, so
+# a burst of load on the machine only spoils a round or two. The medians are
+# compared against benchmarks/baselines/micro.json; cases more than
+# --threshold slower than their baseline are measured again, up to --retries
+# times, and the run exits with status 1 when a case is slower in every try.
+# Baselines still depend on the machine, record them again with
+# --save-baseline after moving to new hardware.
+#
+# Run from the src directory:
+#   python3 -m benchmarks.micro
+#   python3 -m benchmarks.micro --save-baseline
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "micro.json")
+CONSTELLATION_SIZES = (10, 100, 1000, 10000)
+
+
+def time_per_call(fn, min_time=0.2, repeat=5):
+    #best seconds per call, the number of calls per repeat is scaled to take about min_time
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10 or number >= 1 << 20:
+            break
+        number *= 10
+    number = max(1, int(number * (min_time / repeat) / max(elapsed, 1e-9)))
+    best = elapsed / max(1, number)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def reference():
+    #fixed interpreter and libm workload that case times are divided by
+    total = 0.0
+    for i in range(1000):
+        total += math.sin(i) * math.cos(i)
+    return total
+
+
+def make_satellites(count, start_time):
+    rng = random.Random(count)
+    return [
+        {
+            "device_name": f"Satellite{i}",
+            "addr": f"127.0.0.1:{20000 + i}",
+            "orbit": {
+                "init_lat": rng.uniform(-90.0, 90.0),
+                "init_long": rng.uniform(-180.0, 180.0),
+                "inclination": rng.uniform(0.0, 180.0),
+                "direction": rng.choice([-1, 1]),
+                "period": 3600 * rng.uniform(0.1, 24.0) / 100,
+                "start_time": start_time,
+                "altitude": 700.0,
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def make_constellation(count, start_time):
+    #a view filled from a snapshot, never subscribed to a registry
+    view = ConstellationView("127.0.0.1", 0, name=f"Benchmark{count}")
+    view.apply({"event": "snapshot", "version": 1, "satellites": make_satellites(count, start_time)})
+    return view
+
+
+def cases():
+    satellite = SatelliteEmulator("Benchmark", "127.0.0.1", 20000, "127.0.0.1", 20001)
+    tracker = WildLifeTracker(
+        "BirdTrackerDevice42", "127.0.0.1", 33801, (100, 600), (39.0, 43.0),
+        constellation=make_constellation(0, time.time()),
+    )
+    tracker.height, tracker.depth = 1200.0, None
+    orbit = satellite.orbit
+    reading = make_reading(1)
+    iv, tag, ciphertext = encrypt_data(reading, SECRET_KEY)
+
+    yield "calculate_position", lambda: satellite.calculate_position(orbit)
+    yield "haversine", lambda: satellite.haversine(53.34, -6.25, 12.5, 100.2)
+    yield "haversine_3d", lambda: tracker.haversine_3d(53.34, -6.25, 1.2, 12.5, 100.2, 700.0)
+    yield "calculate_checksum", lambda: calculate_checksum(reading)
+    yield "encrypt_data", lambda: encrypt_data(reading, SECRET_KEY)
+    yield "decrypt_data", lambda: decrypt_data(iv, ciphertext, tag, SECRET_KEY)
+
+    data = {"hops": start_trace("BirdTrackerDevice42", time.time())}
+    for size in CONSTELLATION_SIZES:
+        view = make_constellation(size, orbit["start_time"])
+        yield f"closest_hop_scalar[{size}]", on_constellation(satellite, view, satellite.closest_hop_scalar, data)
+        yield f"closest_satellite_scalar[{size}]", on_constellation(tracker, view, tracker.closest_satellite_scalar, 1.2)
+        yield f"closest_hop[{size}]", on_constellation(satellite, view, satellite.closest_hop, data)
+        yield f"closest_satellite[{size}]", on_constellation(tracker, view, tracker.closest_satellite)
+        yield f"next_hop[{size}]", routed(satellite, view, orbit["start_time"])
+
+
+def routed(satellite, view, t):
+    #table lookup of the satellite farthest from the ground, the table is built before timing
+    #as the background builder has it ready before its slice starts
+    routing = RoutingEngine(view, satellite.ground_lat, satellite.ground_long, background=False)
+    table = routing.table(t)
+    addr = table.orbits.satellites[int(table.hops.argmax())]["addr"]
+    return lambda: routing.next_hop(addr, t)
+
+
+def on_constellation(device, view, method, *args):
+    #cases run in rounds, so each one sets the constellation it was built for
+    def run():
+        device.constellation = view
+        return method(*args)
+    return run
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)["cases"]
+
+
+def save_baseline(path, results):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "recorded": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "cases": results,
+        }, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def measure(selected, rounds, min_time):
+    #{name: (seconds per call, relative time)} from the median round of each case
+    samples = {name: [] for name, _ in selected}
+    for _ in range(rounds):
+        for name, fn in selected:
+            unit = time_per_call(reference, min_time / 5)
+            elapsed = time_per_call(fn, min_time)
+            samples[name].append((elapsed / unit, elapsed))
+    medians = {}
+    for name, times in samples.items():
+        relative, elapsed = sorted(times)[len(times) // 2]
+        medians[name] = (elapsed, relative)
+    return medians
+
+
+def main(baseline_path=BASELINE_PATH, threshold=0.5, save=False, match=None, min_time=0.5, rounds=5, retries=2,
+         output=None):
+    baseline = load_baseline(baseline_path)
+    selected = [(name, fn) for name, fn in cases() if not match or match in name]
+    measured = measure(selected, rounds, min_time)
+
+    def slower(name):
+        return name in baseline and measured[name][1] > baseline[name] * (1 + threshold)
+
+    #a real regression is slow again when measured again, noise rarely is twice in a row
+    for _ in range(0 if save else retries):
+        flagged = [(name, fn) for name, fn in selected if slower(name)]
+        if not flagged:
+            break
+        print(f"Measuring {len(flagged)} slower cases again: {', '.join(name for name, _ in flagged)}", flush=True)
+        for name, result in measure(flagged, rounds, min_time).items():
+            measured[name] = min(measured[name], result, key=lambda r: r[1])
+
+    seconds = {name: elapsed for name, (elapsed, _) in measured.items()}
+    results = {name: relative for name, (_, relative) in measured.items()}
+    regressions = []
+    print(f"{'case':<36}{'per call':>14}{'relative':>12}{'baseline':>12}{'ratio':>9}")
+    for name, _ in selected:
+        line = f"{name:<36}{seconds[name] * 1e6:>12.2f}us{results[name]:>12.4f}"
+        if name in baseline:
+            ratio = results[name] / baseline[name]
+            line += f"{baseline[name]:>12.4f}{ratio:>8.2f}x"
+            if slower(name):
+                regressions.append(name)
+                line += "  REGRESSION"
+        else:
+            line += f"{'-':>12}{'-':>9}"
+        print(line, flush=True)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if save:
+        #keep the baselines of cases that were filtered out of this run
+        save_baseline(baseline_path, dict(baseline, **results))
+        print(f"Saved baseline to {baseline_path}")
+        return 0
+    if regressions:
+        print(
+            f"{len(regressions)} cases are more than {threshold:.0%} slower than the baseline "
+            f"after {retries} retries: {', '.join(regressions)}"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the per-message hot functions")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="Fail when a case is slower than its baseline by more than this fraction")
+    parser.add_argument("--save-baseline", action="store_true", help="Record this run as the new baseline")
+    parser.add_argument("--filter", help="Only run cases whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds spent measuring each case per round")
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds over all cases, the median one counts")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="Times a case slower than its baseline is measured again before the run fails")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    sys.exit(main(
+        args.baseline, args.threshold, args.save_baseline, args.filter, args.min_time, args.rounds, args.retries,
+        args.output,
+    ))
@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import time
+import glob
+import signal
+import socket
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+
+import numpy as np
+
+# End-to-end benchmark of the whole network on localhost.
+#
+# Starts the registration server, the ground station, the satellites and the
+# trackers of a scenario file as separate processes on free local ports, lets
+# the trackers report for the scenario's duration, waits for messages still in
+# flight and then reads what arrived from the ground station's telemetry
+# database. Readings sent are summed from the trackers' JSON lines logs, the
+# per-satellite latency breakdown is the ground station's last hop report.
+# Prints one JSON object with throughput, latency percentiles, hop counts,
+# drop rate and that breakdown, to compare runs release to release.
+#
+# Run from the src directory:
+#   python3 -m benchmarks.network benchmarks/scenarios/small.json --output small.json
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = "127.0.0.1"
+
+TRACKER_SCRIPTS = {
+    "bird": "bird_tracker.py",
+    "marine": "marine_animal_tracker.py",
+    "terrestrial": "terrestrial_animal_tracker.py",
+}
+
+DEFAULT_SCENARIO = {
+    "satellites": 3,
+    "satellite_args": [],
+    "ground_station_args": [],
+    "trackers": {"bird": 1, "marine": 1, "terrestrial": 1},
+    "tracker_args": [],
+    "duration": 60,
+    "drain": 5,
+}
+
+
+def load_scenario(path):
+    with open(path) as f:
+        scenario = dict(DEFAULT_SCENARIO, **json.load(f))
+    scenario.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    unknown = set(scenario["trackers"]) - set(TRACKER_SCRIPTS)
+    if unknown:
+        raise ValueError(f"Unknown tracker types {sorted(unknown)}, expected {sorted(TRACKER_SCRIPTS)}")
+    return scenario
+
+
+def free_ports(count):
+    sockets = []
+    for _ in range(count):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind((HOST, 0))
+        sockets.append(s)
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def wait_for_port(port, process, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[1]} exited with code {process.returncode}")
+        try:
+            with socket.create_connection((HOST, port), timeout=1.0):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Nothing listening on {HOST}:{port} after {timeout} seconds")
+
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=SRC_DIR, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+class NetworkBenchmark:
+
+    def __init__(self, scenario, work_dir):
+        self.scenario = scenario
+        self.work_dir = work_dir
+        self.db_path = os.path.join(work_dir, "telemetry.db")
+        self.registry_port, self.ground_station_port, *self.satellite_ports = free_ports(2 + scenario["satellites"])
+        #every process reads these through ip_config
+        self.env = dict(
+            os.environ,
+            REGISTRATION_SERVER_HOST=HOST,
+            REGISTRATION_SERVER_PORT=str(self.registry_port),
+            GROUND_STATION_HOST=HOST,
+            GROUND_STATION_PORT=str(self.ground_station_port),
+        )
+        self.processes = {}
+        self.crashed = []
+
+    def start(self, role, script, *args):
+        #one process per component, console output and JSON lines logs under work_dir
+        log_dir = os.path.join(self.work_dir, "logs", role)
+        with open(os.path.join(self.work_dir, f"{role}.out"), "wb") as output:
+            process = subprocess.Popen(
+                [sys.executable, script, *args, "--log-level", "INFO", "--log-dir", log_dir],
+                cwd=SRC_DIR, env=self.env, stdout=output, stderr=subprocess.STDOUT,
+            )
+        self.processes[role] = process
+        return process
+
+    def stop(self, roles, timeout=10.0):
+        #Ctrl+C lets every component shut down its own way, kill what does not exit
+        for role in roles:
+            process = self.processes[role]
+            if process.poll() is not None:
+                self.crashed.append(role)
+            else:
+                process.send_signal(signal.SIGINT)
+        deadline = time.monotonic() + timeout
+        for role in roles:
+            process = self.processes.pop(role)
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def run(self):
+        scenario = self.scenario
+        try:
+            wait_for_port(self.registry_port, self.start("registry", "satellite_network.py"))
+            ground_station = self.start(
+                "ground_station", "ground_station.py", "--db", self.db_path, *scenario["ground_station_args"]
+            )
+            wait_for_port(self.ground_station_port, ground_station)
+            satellites = []
+            for i, port in enumerate(self.satellite_ports):
+                satellites.append((port, self.start(
+                    f"satellite{i}", "satellite.py", "--name", f"Sat{i}", "--host", HOST, "--port", str(port),
+                    *scenario["satellite_args"],
+                )))
+            for port, process in satellites:
+                wait_for_port(port, process)
+
+            trackers = []
+            start = time.time()
+            for kind, count in scenario["trackers"].items():
+                for i in range(count):
+                    role = f"{kind}{i}"
+                    self.start(role, TRACKER_SCRIPTS[kind], "--host", HOST, "--port", str(i), *scenario["tracker_args"])
+                    trackers.append(role)
+            time.sleep(scenario["duration"])
+            self.stop(trackers)
+            end = time.time()
+            #let messages still in the air reach the ground station
+            time.sleep(scenario["drain"])
+        finally:
+            #the ground station writes out its last batch when it is stopped
+            self.stop([role for role in self.processes if role.startswith("satellite")])
+            self.stop([role for role in ("ground_station", "registry") if role in self.processes])
+        return self.results(end - start)
+
+    def readings_sent(self):
+        sent = 0
+        for kind in TRACKER_SCRIPTS:
+            for path in glob.glob(os.path.join(self.work_dir, "logs", f"{kind}*", "*.jsonl*")):
+                with open(path) as f:
+                    for line in f:
+                        try:
+                            sent += json.loads(line).get("readings_sent", 0)
+                        except ValueError:
+                            continue
+        return sent
+
+    def node_latencies(self):
+        #the ground station logs a line per node when it stops, later lines replace earlier ones
+        nodes = {}
+        for path in sorted(glob.glob(os.path.join(self.work_dir, "logs", "ground_station", "*.jsonl*")), reverse=True):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if "residence_mean" in record:
+                        nodes[record["node"]] = {
+                            key: record[key] for key in ("messages", "residence_mean", "residence_max", "link_mean")
+                        }
+        return nodes
+
+    def duplicates_dropped(self):
+        #readings the ground station dropped as duplicates, it logs a count for each run when it stops
+        dropped = 0
+        for path in glob.glob(os.path.join(self.work_dir, "logs", "ground_station", "*.jsonl*")):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    dropped += record.get("duplicates_dropped", 0)
+        return dropped
+
+    def results(self, elapsed):
+        db = sqlite3.connect(self.db_path)
+        try:
+            rows = db.execute("SELECT device, message_order, latency, path FROM readings").fetchall()
+        finally:
+            db.close()
+        unique = len({(device, order) for device, order, _, _ in rows})
+        latencies = np.array([latency for _, _, latency, _ in rows if latency is not None])
+        #path holds the tracker and every satellite, each "-->" is one hop before the ground station
+        hops = Counter(path.count("-->") for _, _, _, path in rows)
+        sent = self.readings_sent()
+
+        results = {
+            "scenario": self.scenario["name"],
+            "commit": git_commit(),
+            "satellites": self.scenario["satellites"],
+            "trackers": sum(self.scenario["trackers"].values()),
+            "duration_s": elapsed,
+            "readings_sent": sent,
+            "readings_delivered": unique,
+            #dropped by the ground station, plus copies stored when its duplicate filter is off
+            "duplicates": self.duplicates_dropped() + len(rows) - unique,
+            "drop_rate": max(0, sent - unique) / sent if sent else None,
+            "throughput_per_s": unique / elapsed if elapsed else None,
+            "latency_s": None,
+            "hops": {str(h): hops[h] for h in sorted(hops)},
+            "nodes": self.node_latencies(),
+            "crashed": self.crashed,
+            "work_dir": self.work_dir,
+        }
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            results["latency_s"] = {
+                "mean": float(latencies.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(latencies.max()),
+            }
+        return results
+
+
+def main(scenario_path, output=None, work_dir=None):
+    scenario = load_scenario(scenario_path)
+    work_dir = work_dir or tempfile.mkdtemp(prefix=f"benchmark-{scenario['name']}-")
+    os.makedirs(work_dir, exist_ok=True)
+    results = NetworkBenchmark(scenario, os.path.abspath(work_dir)).run()
+    text = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the network on localhost")
+    parser.add_argument("scenario", help="Scenario JSON file, see benchmarks/scenarios")
+    parser.add_argument("--output", help="Also write the results to this file")
+    parser.add_argument("--work-dir", help="Directory for logs and the telemetry database, a new temporary one if not given")
+    args = parser.parse_args()
+
+    main(args.scenario, args.output, args.work_dir)
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+
+from utils.protocol import pack_envelope, unpack_envelope, split_envelope, envelope_parts, send_envelope, recv_envelope
+from utils.trace import start_trace, arrive, depart, path_string
+
+# Compare the legacy JSON + hex envelope against the length-prefixed binary
+# envelope in utils/protocol.py.
+#
+# Run from the src directory:
+#   python3 -m benchmarks.wire_protocol --payload 400 --count 100000
+
+
+def make_message(payload_size):
+    now = time.time()
+    hops = start_trace("BirdTrackerDevice42", now, "Satellite_pi20_33701", 1234.5)
+    arrive(hops, "Satellite_pi20_33701", now + 0.004)
+    depart(hops, now + 0.005, "Satellite_pi20_33702", 2345.6)
+    arrive(hops, "Satellite_pi20_33702", now + 0.013)
+    return {
+        "iv": os.urandom(12),
+        "tag": os.urandom(16),
+        "encrypted_data": os.urandom(payload_size),
+        "hops": hops,
+    }
+
+
+def legacy_encode(message):
+    return json.dumps({
+        "iv": message["iv"].hex(),
+        "encrypted_data": message["encrypted_data"].hex(),
+        "tag": message["tag"].hex(),
+        #the legacy envelope only had the path string
+        "path": path_string(message["hops"]),
+    }).encode("utf-8")
+
+
+def legacy_decode(data):
+    message = json.loads(data.decode("utf-8"))
+    return {
+        "iv": bytes.fromhex(message["iv"]),
+        "encrypted_data": bytes.fromhex(message["encrypted_data"]),
+        "tag": bytes.fromhex(message["tag"]),
+        "path": message["path"],
+    }
+
+
+def time_codec(encode, decode, message, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        decode(encode(message))
+    return count / (time.perf_counter() - start)
+
+
+def time_relay_hop(body, count):
+    #what a relay does per hop: read the route, add its hop record, build the outgoing buffers
+    start = time.perf_counter()
+    for _ in range(count):
+        message = split_envelope(body)
+        now = time.time()
+        arrive(message["hops"], "Satellite_pi20_33703", now)
+        depart(message["hops"], now, "GroundStation", 1500.0)
+        envelope_parts(message)
+    return (time.perf_counter() - start) / count
+
+
+def time_socket(message, count):
+    #stream framed envelopes back to back over a local socket pair
+    a, b = socket.socketpair()
+
+    def sender():
+        for _ in range(count):
+            send_envelope(a, message)
+        a.close()
+
+    start = time.perf_counter()
+    threading.Thread(target=sender, daemon=True).start()
+    received = 0
+    while recv_envelope(b) is not None:
+        received += 1
+    elapsed = time.perf_counter() - start
+    b.close()
+    assert received == count
+    return count / elapsed
+
+
+def main(payload_size, count):
+    message = make_message(payload_size)
+    legacy_size = len(legacy_encode(message))
+    binary_size = len(pack_envelope(message)) + 4
+
+    legacy_rate = time_codec(legacy_encode, legacy_decode, message, count)
+    binary_rate = time_codec(pack_envelope, unpack_envelope, message, count)
+    socket_rate = time_socket(message, count)
+
+    print(f"Payload: {payload_size} bytes ciphertext, {count} messages")
+    print(f"{'envelope':<16}{'bytes/msg':>12}{'msgs/sec':>14}{'MB/sec':>10}")
+    print(f"{'json+hex':<16}{legacy_size:>12}{legacy_rate:>14.0f}{legacy_rate * legacy_size / 1e6:>10.1f}")
+    print(f"{'binary':<16}{binary_size:>12}{binary_rate:>14.0f}{binary_rate * binary_size / 1e6:>10.1f}")
+    print(f"{'binary+socket':<16}{binary_size:>12}{socket_rate:>14.0f}{socket_rate * binary_size / 1e6:>10.1f}")
+    print(f"\nSize ratio: {legacy_size / binary_size:.2f}x, codec speed-up: {binary_rate / legacy_rate:.2f}x")
+
+    print(f"\n{'relay hop':<16}{'payload':>12}{'json+hex us':>14}{'opaque us':>12}")
+    for size in (100, 1000, 10000, 100000):
+        hop_message = make_message(size)
+        hop_count = max(100, count // 10)
+        legacy_hop = time_codec(legacy_encode, legacy_decode, hop_message, hop_count)
+        opaque_hop = time_relay_hop(pack_envelope(hop_message), hop_count)
+        print(f"{'':<16}{size:>12}{1e6 / legacy_hop:>14.2f}{opaque_hop * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wire protocol throughput comparison")
+    parser.add_argument('--payload', type=int, default=400, help="Ciphertext size in bytes")
+    parser.add_argument('--count', type=int, default=100000, help="Number of messages")
+    args = parser.parse_args()
+
+    main(args.payload, args.count)
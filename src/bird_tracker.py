@@ -1,5 +1,9 @@
 import random
 from utils.simulation.wildlife_tracker import WildLifeTracker
+from utils.clock import SYSTEM_CLOCK
+from utils.encryption import USE_CHECKSUM
+from utils.log import setup_logging, add_logging_arguments
+from utils.metrics import start_metrics_server, add_metrics_arguments
 
 #imports WildLifeTracker which controls all trackers
 class BirdTracker(WildLifeTracker):
@@ -11,6 +15,14 @@ class BirdTracker(WildLifeTracker):
         source_port,
         heart_rate_range=(100, 600),
         body_temperature_range=(39.0, 43.0),
+        batch_size=1,
+        batch_interval=0,
+        queue_dir=None,
+        queue_max_items=10000,
+        queue_overflow="drop_oldest",
+        clock=SYSTEM_CLOCK,
+        constellation=None,
+        checksum=USE_CHECKSUM,
     ):
         super().__init__(
             device_name,
@@ -18,6 +30,14 @@ class BirdTracker(WildLifeTracker):
             source_port,
             heart_rate_range,
             body_temperature_range,
+            batch_size,
+            batch_interval,
+            queue_dir,
+            queue_max_items,
+            queue_overflow,
+            clock,
+            constellation,
+            checksum,
         )
         self.height = random.uniform(0, 9000)
 
@@ -32,9 +52,17 @@ class BirdTracker(WildLifeTracker):
 
         return data
 
-def main(host, port):
+def main(host, port, batch_size=1, batch_interval=0, queue_dir=None, queue_max_items=10000, queue_overflow="drop_oldest",
+         log_level="INFO", log_dir="logs", metrics_port=None, metrics_host="127.0.0.1", checksum=USE_CHECKSUM):
     name = "BirdTrackerDevice" + str(random.randint(1, 1000))
-    tracker = BirdTracker(name, host, port)
+    setup_logging(name, log_level, log_dir)
+    if metrics_port:
+        start_metrics_server(metrics_port, metrics_host)
+    tracker = BirdTracker(
+        name, host, port,
+        batch_size=batch_size, batch_interval=batch_interval,
+        queue_dir=queue_dir, queue_max_items=queue_max_items, queue_overflow=queue_overflow, checksum=checksum,
+    )
     tracker.run()
 
 if __name__ == "__main__":
@@ -43,6 +71,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Emulate a bird tracker")
     parser.add_argument('--host', type=str, help="Bird Tracker IP address")
     parser.add_argument('--port', type=str, help="Bird Tracker port")
+    parser.add_argument('--batch-size', type=int, default=1, help="Readings packed into one uplink message")
+    parser.add_argument('--batch-interval', type=float, default=0, help="Milliseconds to wait for a batch to fill")
+    parser.add_argument('--queue-dir', type=str, help="Keep unsent readings in this directory across restarts")
+    parser.add_argument('--queue-max', type=int, default=10000, help="Maximum unsent readings kept in --queue-dir")
+    parser.add_argument('--queue-overflow', type=str, choices=["drop_oldest", "drop_newest", "block"], default="drop_oldest",
+                        help="What to do with new readings when --queue-dir is full")
+    parser.add_argument('--checksum', action=argparse.BooleanOptionalAction, default=USE_CHECKSUM,
+                        help="Add a SHA-256 checksum to every uplink, --no-checksum relies on the AES-GCM tag alone")
+    add_logging_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
     if args.host is None:
@@ -52,4 +90,5 @@ if __name__ == "__main__":
         print("Please specify the Bird Tracker port")
         exit(1)
 
-    main(args.host, args.port)
+    main(args.host, args.port, args.batch_size, args.batch_interval, args.queue_dir, args.queue_max, args.queue_overflow,
+         args.log_level, args.log_dir, args.metrics_port, args.metrics_host, args.checksum)
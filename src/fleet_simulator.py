@@ -0,0 +1,28 @@
+from utils.simulation.fleet_simulator import FleetSimulator
+from utils.encryption import USE_CHECKSUM
+from utils.log import setup_logging, add_logging_arguments
+
+
+def main(birds, marine, terrestrial, connections=4, batch_size=100, report_interval=6.0, duration=None,
+         log_level="INFO", log_dir="logs", checksum=USE_CHECKSUM):
+    setup_logging("fleet_simulator", log_level, log_dir)
+    fleet = FleetSimulator((birds, marine, terrestrial), connections, batch_size, report_interval, checksum=checksum)
+    fleet.run(duration)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Emulate a large population of trackers in one process")
+    parser.add_argument('--birds', type=int, default=1000, help="Number of bird trackers")
+    parser.add_argument('--marine', type=int, default=1000, help="Number of marine animal trackers")
+    parser.add_argument('--terrestrial', type=int, default=1000, help="Number of terrestrial animal trackers")
+    parser.add_argument('--connections', type=int, default=4, help="Sender threads, each with pooled satellite connections")
+    parser.add_argument('--batch-size', type=int, default=100, help="Readings packed into one uplink message")
+    parser.add_argument('--report-interval', type=float, default=6.0, help="Seconds between readings of one tracker")
+    parser.add_argument('--duration', type=float, help="Seconds to run, until Ctrl+C if not given")
+    parser.add_argument('--checksum', action=argparse.BooleanOptionalAction, default=USE_CHECKSUM,
+                        help="Add a SHA-256 checksum to every uplink, --no-checksum relies on the AES-GCM tag alone")
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+
+    main(args.birds, args.marine, args.terrestrial, args.connections, args.batch_size,
+         args.report_interval, args.duration, args.log_level, args.log_dir, args.checksum)
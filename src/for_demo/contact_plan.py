@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from get_satellite_list import get_satellites_list
+from utils.orbit import OrbitArrays
+from utils.contact_plan import ContactPlan
+
+#same ground station as SatelliteEmulator
+GROUND_LAT = 53.3437967
+GROUND_LONG = -6.2571465
+
+
+def print_contact_plan(horizon=3600.0, step=1.0):
+    satellites = get_satellites_list()["satellites"]
+    names = {s["addr"]: s["device_name"] for s in satellites}
+    plan = ContactPlan(OrbitArrays(satellites), GROUND_LAT, GROUND_LONG, time.time(), horizon, step)
+
+    print(f"\nGround station passes in the next {horizon:.0f} seconds:")
+    for start, end, km, addr in plan.passes():
+        print(
+            f"{names[addr]:<20} {datetime.fromtimestamp(start).strftime('%H:%M:%S')} - "
+            f"{datetime.fromtimestamp(end).strftime('%H:%M:%S')}  closest {km:.0f} km"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Print upcoming ground station passes")
+    parser.add_argument('--horizon', type=float, default=3600.0, help="Seconds to look ahead")
+    parser.add_argument('--step', type=float, default=1.0, help="Seconds between propagated positions")
+    args = parser.parse_args()
+
+    print_contact_plan(args.horizon, args.step)
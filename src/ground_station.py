@@ -1,6 +1,47 @@
 from utils.simulation.ground_station import GroundStationReceiver
+from utils.simulation.async_ground_station import AsyncGroundStationReceiver
+from utils.log import setup_logging, add_logging_arguments
+from utils.metrics import start_metrics_server, add_metrics_arguments
 from ip_config import ground_station_host, ground_station_port
 
-    
-station = GroundStationReceiver(ground_station_host, ground_station_port)
-station.listen_for_data()
+
+def main(mode="threaded", workers=4, queue_size=1000, report_interval=10.0, store_path="data/telemetry.db",
+         log_level="INFO", log_dir="logs", metrics_port=None, metrics_host="127.0.0.1",
+         dedup_window=1024, reorder_size=0, reorder_wait=10.0):
+    setup_logging("ground_station", log_level, log_dir)
+    if metrics_port:
+        start_metrics_server(metrics_port, metrics_host)
+    if mode == "async":
+        station = AsyncGroundStationReceiver(
+            ground_station_host, ground_station_port, workers, queue_size, report_interval, store_path,
+            dedup_window=dedup_window, reorder_size=reorder_size, reorder_wait=reorder_wait,
+        )
+    else:
+        station = GroundStationReceiver(
+            ground_station_host, ground_station_port, store_path,
+            dedup_window=dedup_window, reorder_size=reorder_size, reorder_wait=reorder_wait,
+        )
+    station.listen_for_data()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the ground station")
+    parser.add_argument('--mode', type=str, choices=["threaded", "async"], default="threaded",
+                        help="Ingestion front end: one thread per connection or asyncio with a worker pool")
+    parser.add_argument('--workers', type=int, default=4, help="Decrypt/validate worker threads (async mode)")
+    parser.add_argument('--queue-size', type=int, default=1000, help="Messages waiting for a worker before reads pause (async mode)")
+    parser.add_argument('--report-interval', type=float, default=10.0, help="Seconds between ingest rate reports (async mode)")
+    parser.add_argument('--db', type=str, default="data/telemetry.db",
+                        help="SQLite file for received readings, empty to only log them")
+    parser.add_argument('--dedup-window', type=int, default=1024,
+                        help="Readings per device remembered to drop duplicates, 0 to store every copy")
+    parser.add_argument('--reorder-buffer', type=int, default=0,
+                        help="Store each device's readings in order, holding up to this many per device (0: off)")
+    parser.add_argument('--reorder-wait', type=float, default=10.0,
+                        help="Seconds a reading waits for the ones before it when reordering")
+    add_logging_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    main(args.mode, args.workers, args.queue_size, args.report_interval, args.db, args.log_level, args.log_dir,
+         args.metrics_port, args.metrics_host, args.dedup_window, args.reorder_buffer, args.reorder_wait)
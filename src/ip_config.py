@@ -1,11 +1,14 @@
+import os
+
 pi_1_ip = "10.35.70.20"
 pi_2_ip = "10.35.70.41"
 #pi_1_ip = "127.0.0.1"
 #pi_2_ip = "127.0.0.1"
 # Add ip of other pi's
 
-registration_server_host = pi_1_ip
-registration_server_port = 33500
+# The environment overrides these, e.g. to run the whole network on localhost
+registration_server_host = os.environ.get("REGISTRATION_SERVER_HOST", pi_1_ip)
+registration_server_port = int(os.environ.get("REGISTRATION_SERVER_PORT", 33500))
 
-ground_station_host = pi_2_ip
-ground_station_port = 33600
+ground_station_host = os.environ.get("GROUND_STATION_HOST", pi_2_ip)
+ground_station_port = int(os.environ.get("GROUND_STATION_PORT", 33600))
@@ -1,6 +1,6 @@
 #!/bin/bash
 
-pip install cryptography
+pip install cryptography numpy
 
 port=$(shuf -i 33500-33600 -n 1)
 
@@ -1,19 +1,20 @@
 #!/bin/bash
 
-pip install cryptography
+pip install cryptography numpy
 
 # Update ip_config.py
 cat << EOF > ip_config.py
-#!/usr/bin/env python3
+import os
 
 pi_1_ip = "$(hostname -i)"
 pi_2_ip = "$(hostname -i)"
 
-registration_server_host = pi_1_ip
-registration_server_port = 33500
+# The environment overrides these, e.g. to run the whole network on localhost
+registration_server_host = os.environ.get("REGISTRATION_SERVER_HOST", pi_1_ip)
+registration_server_port = int(os.environ.get("REGISTRATION_SERVER_PORT", 33500))
 
-ground_station_host = pi_2_ip
-ground_station_port = 33600
+ground_station_host = os.environ.get("GROUND_STATION_HOST", pi_2_ip)
+ground_station_port = int(os.environ.get("GROUND_STATION_PORT", 33600))
 EOF
 
 echo "ip_config.py updated"
@@ -1,9 +1,26 @@
 from utils.simulation.satellite_emulator import SatelliteEmulator
+from utils.simulation.async_satellite_emulator import AsyncSatelliteEmulator
+from utils.encryption import USE_CHECKSUM
+from utils.log import setup_logging, add_logging_arguments
+from utils.metrics import start_metrics_server, add_metrics_arguments
 from ip_config import ground_station_host, ground_station_port, registration_server_host, registration_server_port
 
 
-def main(name, host, port):
-    satellite = SatelliteEmulator(name, host, port, ground_station_host, ground_station_port)
+def main(name, host, port, mode="threaded", buffer_size=1000, buffer_dir=None, routing="table",
+         log_level="INFO", log_dir="logs", metrics_port=None, metrics_host="127.0.0.1", checksum=USE_CHECKSUM):
+    setup_logging(f"satellite_{name}", log_level, log_dir)
+    if metrics_port:
+        start_metrics_server(metrics_port, metrics_host)
+    if mode == "async":
+        satellite = AsyncSatelliteEmulator(
+            name, host, port, ground_station_host, ground_station_port,
+            buffer_size=buffer_size, buffer_dir=buffer_dir, routing=routing, checksum=checksum,
+        )
+    else:
+        satellite = SatelliteEmulator(
+            name, host, port, ground_station_host, ground_station_port,
+            buffer_size=buffer_size, buffer_dir=buffer_dir, routing=routing, checksum=checksum,
+        )
     satellite.register_to_network(registration_server_host, registration_server_port)
     satellite.get_satellites_list()
     satellite.listen_for_data()
@@ -14,6 +31,18 @@ if __name__ == "__main__":
     parser.add_argument('--name', type=str, help="The name of the satellite")
     parser.add_argument('--host', type=str, help="Satellite IP address")
     parser.add_argument('--port', type=str, help="Satellite port")
+    parser.add_argument('--mode', type=str, choices=["threaded", "async"], default="threaded",
+                        help="Relay implementation: one thread per connection or asyncio")
+    parser.add_argument('--buffer-size', type=int, default=1000,
+                        help="Undeliverable messages kept in memory until a next hop is reachable")
+    parser.add_argument('--buffer-dir', type=str,
+                        help="Spill undeliverable messages beyond --buffer-size to this directory")
+    parser.add_argument('--routing', type=str, choices=["table", "greedy"], default="table",
+                        help="Next hop from the shortest path routing table or always the closest node")
+    parser.add_argument('--checksum', action=argparse.BooleanOptionalAction, default=USE_CHECKSUM,
+                        help="Add a SHA-256 checksum to registry requests, --no-checksum relies on the AES-GCM tag alone")
+    add_logging_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
     if args.name is None:
@@ -26,4 +55,5 @@ if __name__ == "__main__":
         print("Please specify the Satellite port")
         exit(1)
 
-    main(args.name, args.host, args.port)
+    main(args.name, args.host, args.port, args.mode, args.buffer_size, args.buffer_dir, args.routing,
+         args.log_level, args.log_dir, args.metrics_port, args.metrics_host, args.checksum)
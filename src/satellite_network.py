@@ -1,7 +1,19 @@
 from utils.simulation.satellite_network import SatelliteNetwork
+from utils.log import setup_logging, add_logging_arguments
+from utils.metrics import start_metrics_server, add_metrics_arguments
 from ip_config import registration_server_host, registration_server_port
 
 
-# Start registeration server
-satellite_network = SatelliteNetwork(registration_server_host, registration_server_port)
-satellite_network.registration_server()
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the satellite registration server")
+    add_logging_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    setup_logging("network", args.log_level, args.log_dir)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port, args.metrics_host)
+
+    # Start registeration server
+    satellite_network = SatelliteNetwork(registration_server_host, registration_server_port)
+    satellite_network.registration_server()
@@ -0,0 +1,30 @@
+from utils.simulation.discrete_event import DiscreteEventSimulation
+from utils.log import setup_logging, add_logging_arguments
+
+
+def main(satellites, birds, marine, terrestrial, duration=86400.0, report_interval=6.0, routing="table", db=None,
+         seed=None, log_level="INFO", log_dir="logs"):
+    setup_logging("simulation", log_level, log_dir)
+    simulation = DiscreteEventSimulation(
+        satellites, (birds, marine, terrestrial), report_interval, routing, db, seed=seed
+    )
+    simulation.run(duration)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a scenario faster than real time on a virtual clock")
+    parser.add_argument('--satellites', type=int, default=10, help="Number of satellites")
+    parser.add_argument('--birds', type=int, default=1, help="Number of bird trackers")
+    parser.add_argument('--marine', type=int, default=1, help="Number of marine animal trackers")
+    parser.add_argument('--terrestrial', type=int, default=1, help="Number of terrestrial animal trackers")
+    parser.add_argument('--duration', type=float, default=86400.0, help="Simulated seconds")
+    parser.add_argument('--report-interval', type=float, default=6.0, help="Seconds between readings of one tracker")
+    parser.add_argument('--routing', type=str, choices=["table", "greedy"], default="table",
+                        help="Next hop from the shortest path routing table or always the closest node")
+    parser.add_argument('--db', type=str, help="Store the received readings in this SQLite database")
+    parser.add_argument('--seed', type=int, help="Seed for orbits and tracker movement")
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+
+    main(args.satellites, args.birds, args.marine, args.terrestrial, args.duration, args.report_interval,
+         args.routing, args.db, args.seed, args.log_level, args.log_dir)
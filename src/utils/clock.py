@@ -0,0 +1,38 @@
+import time
+
+# Time source for orbit propagation, message timestamps and simulated delays.
+#
+# Components take a clock instead of calling time.time()/time.sleep()
+# directly, so the same code runs on the wall clock in the emulator and on a
+# VirtualClock inside the discrete-event simulation.
+
+
+class WallClock:
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    # Simulated time that only moves when the simulation advances it. sleep()
+    # moves it forward at once, for code that runs outside the event loop.
+
+    def __init__(self, start=None):
+        self.now = time.time() if start is None else start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.advance_to(self.now + seconds)
+
+    def advance_to(self, t):
+        if t < self.now:
+            raise ValueError(f"Cannot move the clock back from {self.now} to {t}")
+        self.now = t
+
+
+SYSTEM_CLOCK = WallClock()
@@ -0,0 +1,82 @@
+import time
+import select
+import socket
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    # Long-lived TCP connections to other satellites and the ground station,
+    # keyed by "host:port". Relays borrow a socket, send a frame, read the ack
+    # and give it back instead of connecting for every message.
+
+    def __init__(self, max_idle_per_addr=4, idle_timeout=60.0, connect_timeout=5.0):
+        self.max_idle_per_addr = max_idle_per_addr
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def is_healthy(self, sock):
+        #an idle socket that is readable has either been closed by the peer or has stray data
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            return not readable
+        except (OSError, ValueError):
+            return False
+
+    def acquire(self, addr):
+        now = time.monotonic()
+        with self.lock:
+            idle = self.idle.get(addr, [])
+            while idle:
+                sock, last_used = idle.pop()
+                if now - last_used < self.idle_timeout and self.is_healthy(sock):
+                    return sock
+                sock.close()
+
+        h, p = addr.split(":")
+        sock = socket.create_connection((h, int(p)), timeout=self.connect_timeout)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def release(self, addr, sock):
+        with self.lock:
+            idle = self.idle.setdefault(addr, [])
+            if len(idle) < self.max_idle_per_addr:
+                idle.append((sock, time.monotonic()))
+                return
+        sock.close()
+
+    @contextmanager
+    def connection(self, addr):
+        #broken sockets are closed instead of going back to the pool
+        sock = self.acquire(addr)
+        try:
+            yield sock
+        except BaseException:
+            sock.close()
+            raise
+        self.release(addr, sock)
+
+    def evict(self, addr):
+        with self.lock:
+            idle = self.idle.pop(addr, [])
+        for sock, _ in idle:
+            sock.close()
+
+    def retain(self, addrs):
+        #drop pooled connections to peers that are no longer registered
+        addrs = set(addrs)
+        with self.lock:
+            stale = [addr for addr in self.idle if addr not in addrs]
+        for addr in stale:
+            self.evict(addr)
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for sock, _ in connections:
+                sock.close()
@@ -0,0 +1,148 @@
+import json
+import time
+import socket
+import threading
+
+from utils.encryption import SECRET_KEY, USE_CHECKSUM
+from utils.crypto import seal
+from utils.protocol import send_envelope, recv_text
+from utils.orbit import OrbitArrays
+from utils.spatial_index import ConstellationIndex
+from utils.log import get_logger
+
+log = get_logger("constellation")
+
+
+class ConstellationView:
+    # Local copy of the registered satellites, kept current by one long-lived
+    # "subscribe" session with the registration server. The server sends a
+    # snapshot first and then pushes register/deregister events, so hot paths
+    # read the list from memory instead of asking the server per message.
+
+    def __init__(self, network_host, network_port, name="Constellation", retry_interval=5.0, checksum=USE_CHECKSUM):
+        self.network_host = network_host
+        self.network_port = int(network_port)
+        self.name = name
+        self.retry_interval = retry_interval
+        #add a SHA-256 checksum to requests on top of the AES-GCM tag
+        self.checksum = checksum
+
+        self.satellites_by_addr = {}
+        self.version = 0
+        #last registry version applied and the registry run it belongs to, sent on
+        #reconnect to only receive the delta
+        self.registry_version = None
+        self.registry_epoch = None
+        self.orbits = None
+        self.orbits_version = -1
+        self.index = None
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.listeners = []
+        self.running = True
+        self.sock = None
+
+    def add_listener(self, callback):
+        #callback(event, satellite) is called after every register/deregister
+        self.listeners.append(callback)
+
+    def start(self, timeout=10.0):
+        threading.Thread(target=self.run, daemon=True).start()
+        if not self.ready.wait(timeout):
+            log.warning(f"[{self.name}] Timed out waiting for the satellite list")
+
+    def stop(self):
+        self.running = False
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def satellites(self):
+        with self.lock:
+            return list(self.satellites_by_addr.values())
+
+    def orbit_arrays(self):
+        #NumPy orbit parameters, rebuilt only when the constellation changes
+        with self.lock:
+            if self.orbits_version != self.version:
+                self.orbits = OrbitArrays(self.satellites_by_addr.values())
+                self.orbits_version = self.version
+                self.index = None
+            return self.orbits
+
+    def spatial_index(self, slice_seconds=1.0):
+        #KD-tree over the constellation, refreshed per time slice by the caller's queries
+        orbits = self.orbit_arrays()
+        with self.lock:
+            if self.index is None or self.index.orbits is not orbits:
+                self.index = ConstellationIndex(orbits, slice_seconds)
+            return self.index
+
+    def subscribe(self, sock):
+        if self.registry_version is None:
+            data = {"content": "subscribe"}
+        else:
+            data = {"content": f"subscribe {self.registry_version} {self.registry_epoch}"}
+        send_envelope(sock, seal(data, SECRET_KEY, self.checksum))
+
+    def run(self):
+        while self.running:
+            try:
+                with socket.create_connection((self.network_host, self.network_port)) as sock:
+                    self.sock = sock
+                    self.subscribe(sock)
+                    while self.running:
+                        res = recv_text(sock)
+                        if res is None:
+                            break
+                        self.apply(json.loads(res))
+            except (OSError, ValueError) as e:
+                if self.running:
+                    log.warning(f"[{self.name}] Registry subscription error: {e}")
+            finally:
+                self.sock = None
+
+            if self.running:
+                log.warning(f"[{self.name}] Registry subscription lost, retrying in {self.retry_interval} seconds...")
+                time.sleep(self.retry_interval)
+
+    def apply(self, event):
+        if event["event"] == "delta":
+            for change in event["changes"]:
+                self.apply(change)
+            with self.lock:
+                self.registry_version = event["version"]
+                self.registry_epoch = event.get("epoch")
+            self.ready.set()
+            return
+
+        kind = event["event"]
+        changes = []
+        with self.lock:
+            if kind == "snapshot":
+                satellites = {s["addr"]: s for s in event["satellites"]}
+                #satellites that left while we were disconnected
+                changes = [
+                    ("deregister", s) for addr, s in self.satellites_by_addr.items()
+                    if addr not in satellites
+                ]
+                self.satellites_by_addr = satellites
+                self.registry_epoch = event.get("epoch")
+            elif kind == "register":
+                satellite = event["satellite"]
+                self.satellites_by_addr[satellite["addr"]] = satellite
+                changes = [(kind, satellite)]
+            elif kind == "deregister":
+                satellite = self.satellites_by_addr.pop(event["addr"], {"addr": event["addr"]})
+                changes = [(kind, satellite)]
+            else:
+                return
+            self.version += 1
+            self.registry_version = event.get("version", self.registry_version)
+
+        self.ready.set()
+        for change, satellite in changes:
+            for callback in self.listeners:
+                callback(change, satellite)
@@ -0,0 +1,121 @@
+import threading
+
+import numpy as np
+
+from utils.clock import SYSTEM_CLOCK
+from utils.orbit import GROUND_RANGE_KM, OrbitArrays, haversine_np
+
+# Ground station passes predicted from the registered orbits.
+#
+# Orbits are deterministic, so the times at which each satellite is within
+# range_km of the ground station can be computed ahead of time. Positions are
+# propagated for a grid of times over the horizon in one OrbitArrays call and
+# every run of in-range samples becomes a contact window
+# (start, end, closest distance in km).
+
+
+class ContactPlan:
+
+    def __init__(self, orbits, ground_lat, ground_long, start, horizon=3600.0, step=1.0,
+                 range_km=GROUND_RANGE_KM, max_samples=2_000_000):
+        self.orbits = orbits
+        self.start = start
+        self.end = start + horizon
+        self.step = step
+        self.windows = {s["addr"]: [] for s in orbits.satellites}
+
+        times = start + np.arange(0, horizon + step, step)
+        #propagate a block of satellites at a time to bound the (time, satellite) arrays
+        chunk = max(1, max_samples // len(times))
+        for lo in range(0, len(orbits), chunk):
+            hi = min(lo + chunk, len(orbits))
+            block = orbits if hi - lo == len(orbits) else OrbitArrays(orbits.satellites[lo:hi])
+            lat, long = block.positions(times[:, None])
+            distance = haversine_np(lat, long, ground_lat, ground_long)
+            visible = np.zeros((len(times) + 2, hi - lo), dtype=np.int8)
+            visible[1:-1] = distance <= range_km
+            #+1 where a pass starts, -1 one sample after it ends
+            edges = np.diff(visible, axis=0).T
+            for col in range(hi - lo):
+                starts = np.flatnonzero(edges[col] == 1)
+                ends = np.flatnonzero(edges[col] == -1)
+                windows = self.windows[orbits.satellites[lo + col]["addr"]]
+                for s, e in zip(starts, ends):
+                    windows.append((float(times[s]), float(times[e - 1]), float(distance[s:e, col].min())))
+
+    def next_contact(self, addr, t):
+        #current or next window of the satellite at addr, None if none within the horizon
+        for window in self.windows.get(addr, []):
+            if window[1] >= t:
+                return window
+        return None
+
+    def in_contact(self, addr, t):
+        window = self.next_contact(addr, t)
+        return window is not None and window[0] <= t
+
+    def passes(self):
+        #all windows as (start, end, closest km, addr), in order of start time
+        return sorted(
+            (start, end, km, addr)
+            for addr, windows in self.windows.items()
+            for start, end, km in windows
+        )
+
+
+class ContactPlanner:
+    # Contact plan for a ConstellationView, regenerated when the constellation
+    # changes or half of the horizon has passed.
+    #
+    # A plan takes a while to compute for large constellations, so plan()
+    # never computes one: it returns the current plan and starts a builder
+    # thread when that plan is stale, which swaps the new one in when done.
+    # Orbits do not change, so until then the previous plan is still right
+    # for every satellite it knows. Before the first plan is ready plan()
+    # returns None. With background=False, for the discrete-event simulation,
+    # plan() builds a stale plan itself.
+
+    def __init__(self, constellation, ground_lat, ground_long, horizon=3600.0, step=1.0,
+                 range_km=GROUND_RANGE_KM, clock=SYSTEM_CLOCK, background=True):
+        self.constellation = constellation
+        self.ground_lat = ground_lat
+        self.ground_long = ground_long
+        self.horizon = horizon
+        self.step = step
+        self.range_km = range_km
+        self.clock = clock
+        self.background = background
+        self.current = None
+        self.builder = None
+        self.lock = threading.Lock()
+        if background:
+            #start on the plan for a new constellation before a message asks for it
+            constellation.add_listener(lambda event, satellite: self.plan(self.clock.time()))
+
+    def build(self, orbits, t):
+        return ContactPlan(
+            orbits, self.ground_lat, self.ground_long, t,
+            self.horizon, self.step, self.range_km,
+        )
+
+    def plan(self, t):
+        orbits = self.constellation.orbit_arrays()
+        with self.lock:
+            current = self.current
+            if current is not None and current.orbits is orbits and t <= current.start + self.horizon / 2:
+                return current
+            if not self.background:
+                current = self.current = self.build(orbits, t)
+            elif self.builder is None:
+                self.builder = threading.Thread(target=self.run, args=(orbits, t), daemon=True)
+                self.builder.start()
+            return current
+
+    def run(self, orbits, t):
+        try:
+            plan = self.build(orbits, t)
+            with self.lock:
+                self.current = plan
+        finally:
+            with self.lock:
+                self.builder = None
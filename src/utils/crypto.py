@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from utils.encryption import USE_CHECKSUM
+
+# AES-GCM encryption and checksums shared by every component.
+#
+# AESGCM objects are built once per key and reused; the old code built a new
+# Cipher for every message. AES-GCM already authenticates the ciphertext with
+# its tag, so the SHA-256 checksum over the sorted JSON is optional: each
+# sending component takes checksum= (default USE_CHECKSUM), and with it off
+# skips the checksum so receivers rely on the tag alone.
+# Receivers always verify a checksum when the sender included one.
+
+IV_SIZE = 12
+TAG_SIZE = 16
+
+aead_cache = {}
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def get_aead(key):
+    aead = aead_cache.get(key)
+    if aead is None:
+        aead = aead_cache[key] = AESGCM(key)
+    return aead
+
+
+def calculate_checksum(data):
+    json_data = json.dumps(data, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(json_data).hexdigest()
+
+
+def encrypt_data(data, key):
+    iv = os.urandom(IV_SIZE)
+    sealed = get_aead(key).encrypt(iv, json.dumps(data).encode("utf-8"), None)
+    return iv, sealed[-TAG_SIZE:], sealed[:-TAG_SIZE]
+
+
+def decrypt_data(iv, encrypted_data, tag, key):
+    #raises cryptography.exceptions.InvalidTag if the message was tampered with
+    decrypted_data = get_aead(key).decrypt(iv, bytes(encrypted_data) + tag, None)
+    return json.loads(decrypted_data)
+
+
+def encrypt_batch(items, key):
+    #the whole batch as one message, one nonce, tag and JSON encoding instead of one per item,
+    #in the {"batch": [...]} form batched uplinks use
+    return encrypt_data({"batch": items}, key)
+
+
+def decrypt_batch(iv, encrypted_data, tag, key):
+    return decrypt_data(iv, encrypted_data, tag, key)["batch"]
+
+
+def seal(data, key, checksum=None):
+    #encrypt data into an envelope message, adding a checksum unless disabled
+    if checksum is None:
+        checksum = USE_CHECKSUM
+    if checksum:
+        data["checksum"] = calculate_checksum(data)
+    iv, tag, encrypted_data = encrypt_data(data, key)
+    return {"iv": iv, "encrypted_data": encrypted_data, "tag": tag}
+
+
+def verify_checksum(data):
+    #pop and check the checksum, True when there is none to check
+    received_checksum = data.pop("checksum", None)
+    if received_checksum is None:
+        return True
+    return received_checksum == calculate_checksum(data)
+
+
+def open_sealed(message, key):
+    data = decrypt_data(message["iv"], message["encrypted_data"], message["tag"], key)
+    if not verify_checksum(data):
+        raise ChecksumError("Checksum mismatch")
+    return data
@@ -0,0 +1,81 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.clock import SYSTEM_CLOCK
+from utils.log import get_logger
+
+log = get_logger("delay_scheduler")
+
+
+class DelayScheduler:
+    # Delayed calls for messages that are "in the air". Pending calls wait in a
+    # heap ordered by due time and one timer thread sleeps until the earliest
+    # is due, so thousands of in-flight messages cost a heap entry each instead
+    # of a sleeping thread. Due calls run on a small worker pool, so one slow
+    # next hop does not hold up the others. Threads start with the first call.
+    # Due times come from the injected clock; the timer waits out the
+    # difference in real seconds, so a virtual clock has to keep pace.
+
+    def __init__(self, workers=8, name="DelayScheduler", clock=SYSTEM_CLOCK):
+        self.workers = workers
+        self.name = name
+        self.clock = clock
+        self.pending = []
+        #calls due at the same time run in the order they were scheduled
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.running = True
+        self.timer = None
+        self.executor = None
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+    def call_later(self, delay, callback, *args):
+        due = self.clock.time() + max(0.0, delay)
+        with self.lock:
+            if not self.running:
+                raise RuntimeError(f"{self.name} is stopped")
+            if self.timer is None:
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+                self.timer = threading.Thread(target=self.run, name=f"{self.name}-timer", daemon=True)
+                self.timer.start()
+            heapq.heappush(self.pending, (due, next(self.sequence), callback, args))
+            #only a new earliest call changes how long the timer sleeps
+            if self.pending[0][0] == due:
+                self.wakeup.notify()
+
+    def run(self):
+        while True:
+            with self.lock:
+                now = self.clock.time()
+                while self.running and (not self.pending or self.pending[0][0] > now):
+                    self.wakeup.wait(self.pending[0][0] - now if self.pending else None)
+                    now = self.clock.time()
+                if not self.running:
+                    return
+                #submit under the lock, stop() shuts the pool down only after running is cleared
+                while self.pending and self.pending[0][0] <= now:
+                    _, _, callback, args = heapq.heappop(self.pending)
+                    self.executor.submit(self.call, callback, args)
+
+    def call(self, callback, args):
+        try:
+            callback(*args)
+        except Exception:
+            log.exception(f"[{self.name}] Scheduled call failed")
+
+    def stop(self, wait=True):
+        #calls not yet due are not run, returns them as (callback, args) in due order
+        with self.lock:
+            self.running = False
+            pending = [(callback, args) for _, _, callback, args in sorted(self.pending)]
+            self.pending = []
+            self.wakeup.notify()
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+        return pending
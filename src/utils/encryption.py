@@ -1,2 +1,6 @@
 # Shared secret key (should be securely exchanged between client and server)
 SECRET_KEY = b"supersecretkey12"  # 16 bytes for AES-128
+
+# Add a SHA-256 checksum to every message on top of the AES-GCM tag, the
+# default for components that are not given checksum= (--no-checksum)
+USE_CHECKSUM = True
@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+
+# Shared logging for the registry, satellites, ground station and trackers.
+#
+# Callers only put records on an in-memory queue (QueueHandler); one listener
+# thread per process formats them and writes the console and a JSON lines
+# file under logs/ that rotates by size. Per message detail such as full
+# payloads is logged at DEBUG, so with the default INFO level those calls
+# return before anything is formatted. Build expensive messages lazily:
+#
+#     log.debug("Data to be sent: %s", data)
+#
+# or guard them with log.isEnabledFor(logging.DEBUG).
+
+LOGGER_NAME = "wildlife"
+
+listener = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    # One JSON object per record, extra={"fields": {...}} adds structured fields
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "service": self.service,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler formats the message in the calling thread, this leaves it
+    # to the listener. Records never leave the process, so they can be queued
+    # as they are.
+
+    def prepare(self, record):
+        return record
+
+
+def get_logger(name=None):
+    return logging.getLogger(LOGGER_NAME if name is None else f"{LOGGER_NAME}.{name}")
+
+
+def setup_logging(service, level="INFO", log_dir="logs", max_bytes=10 * 1024 * 1024, backup_count=5, console=True):
+    #route this process's logs through one background writer, safe to call again
+    global listener
+    logger = get_logger()
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    if listener is not None:
+        return logger
+
+    handlers = []
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+        file_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in service) + ".jsonl"
+        file_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(log_dir, file_name), maxBytes=max_bytes, backupCount=backup_count
+        )
+        file_handler.setFormatter(JsonLinesFormatter(service))
+        handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter("%(message)s"))
+        handlers.append(console_handler)
+
+    records = queue.SimpleQueue()
+    logger.addHandler(DeferredQueueHandler(records))
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    #write out what is still queued on a normal exit
+    atexit.register(stop_logging)
+    return logger
+
+
+def stop_logging():
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def add_logging_arguments(parser):
+    parser.add_argument('--log-level', type=str, default=os.environ.get("LOG_LEVEL", "INFO"),
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="DEBUG also logs every payload and hop")
+    parser.add_argument('--log-dir', type=str, default="logs", help="Directory for the JSON lines log, empty to disable")
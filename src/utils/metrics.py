@@ -0,0 +1,231 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.log import get_logger
+
+log = get_logger("metrics")
+
+# Counters, gauges and histograms for a process, served in the Prometheus text
+# format at http://<host>:<port>/metrics.
+#
+# Modules create their metrics once at import time, the same name returns the
+# same metric. Recording is an addition under a per-metric lock (plus a bisect
+# for histograms) and nothing is formatted until the endpoint is scraped, so
+# the metrics stay on all the time. Gauges for queue depths read the queue
+# through a callback at scrape time instead of being updated per message.
+
+PREFIX = "wildlife_"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+HOP_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterValue:
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, (), self.value
+
+
+class GaugeValue:
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        #read the value at scrape time, e.g. a queue's qsize
+        self.function = function
+
+    def samples(self, name, labels):
+        function = self.function
+        if function is not None:
+            try:
+                value = function()
+            except Exception:
+                return
+        else:
+            value = self.value
+        yield name, labels, (), value
+
+
+class HistogramValue:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            yield f"{name}_bucket", labels, (("le", format_value(float(bound))),), cumulative
+        yield f"{name}_sum", labels, (), total
+        yield f"{name}_count", labels, (), cumulative
+
+
+class Metric:
+    # One metric and its values per label combination. Without label names
+    # the metric itself takes inc/set/observe.
+
+    def __init__(self, kind, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.default = self.labels()
+
+    def new_value(self):
+        if self.kind == "counter":
+            return CounterValue()
+        if self.kind == "gauge":
+            return GaugeValue()
+        return HistogramValue(self.buckets)
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}")
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_value())
+        return child
+
+    def inc(self, amount=1):
+        self.default.inc(amount)
+
+    def set(self, value):
+        self.default.set(value)
+
+    def set_function(self, function):
+        self.default.set_function(function)
+
+    def observe(self, value):
+        self.default.observe(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            for name, labels, extra, value in child.samples(self.name, values):
+                lines.append(f"{name}{format_labels(self.labelnames, labels, extra)} {format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def get(self, kind, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        name = PREFIX + name
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = Metric(kind, name, documentation, labelnames, buckets)
+            elif metric.kind != kind:
+                raise ValueError(f"{name} is already a {metric.kind}")
+            return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.get("counter", name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.get("gauge", name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.get("histogram", name, documentation, labelnames, buckets)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        #scrapes are not worth a log line each
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    #serve /metrics from a daemon thread, returns the server
+    server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info(f"[Metrics] Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics-port', type=int, help="Serve Prometheus metrics on this port, off if not given")
+    parser.add_argument('--metrics-host', type=str, default="127.0.0.1", help="Address for the metrics endpoint")
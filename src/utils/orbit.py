@@ -0,0 +1,84 @@
+import math
+
+import numpy as np
+
+# Orbit propagation and distances for the whole constellation at once.
+#
+# These are the batched versions of calculate_position, haversine and
+# haversine_3d in SatelliteEmulator and WildLifeTracker, which stay as the
+# scalar reference implementation.
+
+EARTH_RADIUS = 6371.0
+EARTH_ROTATION_RATE = 360 / 86400
+SPEED_OF_LIGHT = 299_792.458
+#surface distance within which a satellite at 700 km can reach the ground station
+GROUND_RANGE_KM = 3000.0
+
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+class OrbitArrays:
+    # Orbit parameters of a list of registered satellites as NumPy arrays
+
+    def __init__(self, satellites):
+        self.satellites = list(satellites)
+        orbits = [s["orbit"] for s in self.satellites]
+
+        self.init_lat = np.array([o["init_lat"] for o in orbits], dtype=float)
+        self.init_long = np.array([o["init_long"] for o in orbits], dtype=float)
+        self.inclination = np.array([o["inclination"] for o in orbits], dtype=float)
+        self.direction = np.array([o["direction"] for o in orbits], dtype=float)
+        self.period = np.array([o["period"] for o in orbits], dtype=float)
+        self.start_time = np.array([o["start_time"] for o in orbits], dtype=float)
+        self.altitude = np.array([o.get("altitude", 700.0) for o in orbits], dtype=float)
+
+        self.index_by_name = {}
+        for i, satellite in enumerate(self.satellites):
+            self.index_by_name.setdefault(satellite["device_name"], []).append(i)
+
+    def __len__(self):
+        return len(self.satellites)
+
+    def positions(self, t):
+        #lat/long of every satellite at time t, t may also be a column of times
+        elapsed = t - self.start_time
+        theta = (2 * math.pi * elapsed) / self.period
+
+        long = self.init_long + np.degrees(theta) * self.direction + EARTH_ROTATION_RATE * elapsed
+        long = (long + 180) % 360 - 180
+
+        lat = self.init_lat + np.sin(theta) * self.inclination
+        lat = np.clip(lat, -90, 90)
+
+        return lat, long
+
+    def exclusion_mask(self, names):
+        #True for satellites whose device_name is not in names
+        mask = np.ones(len(self.satellites), dtype=bool)
+        for name in names:
+            mask[self.index_by_name.get(name, [])] = False
+        return mask
+
+    def distances(self, lat, long, t, h=None):
+        #surface distance to every satellite, or 3D distance when h (km) is given
+        sat_lat, sat_long = self.positions(t)
+        d = haversine_np(lat, long, sat_lat, sat_long)
+        if h is not None:
+            d = np.sqrt(d ** 2 + (self.altitude - h) ** 2)
+        return d
+
+    def nearest(self, lat, long, t, h=None, exclude=()):
+        #index and distance of the closest satellite, (None, inf) if none is left
+        if not self.satellites:
+            return None, float("inf")
+        d = self.distances(lat, long, t, h)
+        if exclude:
+            d = np.where(self.exclusion_mask(exclude), d, np.inf)
+        i = int(np.argmin(d))
+        if not np.isfinite(d[i]):
+            return None, float("inf")
+        return i, float(d[i])
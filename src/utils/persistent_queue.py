@@ -0,0 +1,197 @@
+import os
+import json
+import queue
+import threading
+from collections import deque
+
+
+class PersistentQueue:
+    # Disk-backed FIFO with the queue.Queue methods the tracker uses.
+    #
+    # Items are appended as JSON lines to <directory>/queue.log and the byte
+    # offset of the last acknowledged item is kept in <directory>/queue.offset.
+    # get_nowait()/get() hand out items, task_done() acknowledges the oldest
+    # handed out item and moves the commit offset, rewind() makes handed out
+    # but unacknowledged items available again. After a restart every item past
+    # the commit offset is replayed with "restored" set.
+    #
+    # The queue holds at most max_items unacknowledged items. When it is full,
+    # overflow decides what happens to a new item: "drop_oldest" discards the
+    # oldest item, "drop_newest" discards the new one and "block" waits for
+    # space.
+
+    OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+    def __init__(self, directory, max_items=10000, overflow="drop_oldest", fsync=False, compact_bytes=1024 * 1024):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.directory = directory
+        self.max_items = max_items
+        self.overflow = overflow
+        self.fsync = fsync
+        self.compact_bytes = compact_bytes
+
+        self.log_path = os.path.join(directory, "queue.log")
+        self.offset_path = os.path.join(directory, "queue.offset")
+
+        #(end offset in the log, item, restored) for every unacknowledged item
+        self.pending = deque()
+        #how many of the pending items have been handed out
+        self.in_flight = 0
+        self.skip_acks = 0
+        self.dropped = 0
+        self.last_item = None
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+        self.log = open(self.log_path, "ab")
+
+    def load(self):
+        committed = 0
+        if os.path.exists(self.offset_path):
+            with open(self.offset_path) as f:
+                committed = int(f.read().strip() or 0)
+        self.committed = committed
+        if not os.path.exists(self.log_path):
+            return
+
+        with open(self.log_path, "rb") as f:
+            offset = 0
+            valid_end = 0
+            for line in f:
+                offset += len(line)
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError
+                    item = json.loads(line)
+                except ValueError:
+                    #torn write from a crash, everything after it is dropped
+                    break
+                valid_end = offset
+                self.last_item = item
+                if offset > committed:
+                    self.pending.append((offset, item, True))
+
+        if valid_end < os.path.getsize(self.log_path):
+            with open(self.log_path, "r+b") as f:
+                f.truncate(valid_end)
+
+    def write_offset(self):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self.committed))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def compact(self):
+        #rewrite the log without acknowledged items, caller holds self.lock
+        if self.committed < self.compact_bytes:
+            return
+        self.log.close()
+        tmp_path = self.log_path + ".tmp"
+        pending = deque()
+        with open(tmp_path, "wb") as f:
+            for _, item, restored in self.pending:
+                f.write(json.dumps(item).encode("utf-8") + b"\n")
+                pending.append((f.tell(), item, restored))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        self.committed = 0
+        self.write_offset()
+        os.replace(tmp_path, self.log_path)
+        self.pending = pending
+        self.log = open(self.log_path, "ab")
+
+    def put(self, item, block=True, timeout=None):
+        #returns False if the item was dropped because the queue is full
+        with self.lock:
+            if len(self.pending) >= self.max_items:
+                if self.overflow == "drop_newest":
+                    self.dropped += 1
+                    return False
+                if self.overflow == "block":
+                    if not block or not self.not_full.wait_for(
+                        lambda: len(self.pending) < self.max_items, timeout
+                    ):
+                        raise queue.Full
+                else:
+                    self.drop_oldest()
+
+            self.log.write(json.dumps(item).encode("utf-8") + b"\n")
+            self.log.flush()
+            if self.fsync:
+                os.fsync(self.log.fileno())
+            self.pending.append((self.log.tell(), item, False))
+            self.last_item = item
+            self.not_empty.notify()
+            return True
+
+    def drop_oldest(self):
+        #caller holds self.lock
+        offset, _, _ = self.pending.popleft()
+        if self.in_flight:
+            #the acknowledgment for the dropped item is still coming
+            self.in_flight -= 1
+            self.skip_acks += 1
+        self.committed = offset
+        self.write_offset()
+        self.dropped += 1
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get(self, block=True, timeout=None):
+        with self.lock:
+            if not self.not_empty.wait_for(
+                lambda: self.in_flight < len(self.pending), timeout if block else 0
+            ):
+                raise queue.Empty
+            _, item, restored = self.pending[self.in_flight]
+            self.in_flight += 1
+            item = dict(item)
+            if restored:
+                item["restored"] = True
+            return item
+
+    def task_done(self):
+        #acknowledge the oldest handed out item
+        with self.lock:
+            if self.skip_acks:
+                self.skip_acks -= 1
+                return
+            if not self.in_flight:
+                raise ValueError("task_done() called without an item in flight")
+            offset, _, _ = self.pending.popleft()
+            self.in_flight -= 1
+            self.committed = offset
+            self.write_offset()
+            self.compact()
+            self.not_full.notify()
+
+    def rewind(self):
+        #hand out unacknowledged items again, e.g. after a lost connection
+        with self.lock:
+            for i in range(self.in_flight):
+                offset, item, _ = self.pending[i]
+                self.pending[i] = (offset, item, True)
+            self.in_flight = 0
+            self.skip_acks = 0
+            if self.pending:
+                self.not_empty.notify()
+
+    def qsize(self):
+        with self.lock:
+            return len(self.pending) - self.in_flight
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def close(self):
+        with self.lock:
+            self.log.close()
@@ -0,0 +1,291 @@
+import math
+import struct
+import asyncio
+
+# Wire protocol shared by trackers, satellites, the registration server and the
+# ground station.
+#
+# Every message is a frame: a 4-byte big-endian length followed by that many
+# bytes of body, so reads never depend on the recv() buffer size and back to
+# back messages on one connection stay separate.
+#
+# Encrypted messages use an envelope body with the raw AES-GCM fields instead
+# of hex strings inside JSON:
+#
+#   route length (2) | route | iv (12) | tag (16) | ciphertext
+#
+# The route is the per-hop trace of utils/trace.py (message["hops"]), one
+# packed record per node the message passed:
+#
+#   name length (1) | name (utf-8) | arrived (8) | departed (8) | distance km (4)
+#   | next hop length (1) | next hop (utf-8)
+#
+# with NaN for missing times and distances. The route header is the only part
+# relays touch:
+# they keep iv/tag/ciphertext as one opaque "payload" buffer (see
+# split_envelope) and write it back out with scatter/gather sends, so per hop
+# work does not depend on the payload size.
+
+FRAME_HEADER = struct.Struct("!I")
+ROUTE_HEADER = struct.Struct("!H")
+HOP_TIMES = struct.Struct("!ddf")
+
+IV_SIZE = 12
+TAG_SIZE = 16
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+class ProtocolError(ValueError):
+    #a truncated, oversized or malformed frame, handlers close the connection
+    pass
+
+
+def recv_exact(sock, size):
+    #read exactly size bytes, None if the peer closed before sending anything
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            if received == 0:
+                return None
+            raise ProtocolError(f"Connection closed after {received} of {size} bytes")
+        received += n
+    return buf
+
+
+def recv_exact_into(sock, view):
+    #fill view completely, False if the peer closed before sending anything
+    size = len(view)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            if received == 0:
+                return False
+            raise ProtocolError(f"Connection closed after {received} of {size} bytes")
+        received += n
+    return True
+
+
+def send_buffers(sock, buffers):
+    #sendall for a list of buffers without joining them into one
+    buffers = [memoryview(b) for b in buffers if len(b)]
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        while sent:
+            if sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            else:
+                buffers[0] = buffers[0][sent:]
+                sent = 0
+
+
+class FrameReader:
+    # Reads frames from one connection into a reusable buffer. The memoryview
+    # returned by read() is only valid until the next read(); copy it with
+    # bytes() to keep it.
+
+    def __init__(self, sock, size=4096):
+        self.sock = sock
+        self.header = bytearray(FRAME_HEADER.size)
+        self.buffer = bytearray(size)
+
+    def read(self):
+        if not recv_exact_into(self.sock, memoryview(self.header)):
+            return None
+        (size,) = FRAME_HEADER.unpack(self.header)
+        if size > MAX_FRAME_SIZE:
+            raise ProtocolError(f"Frame of {size} bytes exceeds limit")
+        if size > len(self.buffer):
+            self.buffer = bytearray(max(size, 2 * len(self.buffer)))
+        view = memoryview(self.buffer)[:size]
+        if size and not recv_exact_into(self.sock, view):
+            raise ProtocolError("Connection closed before frame body")
+        return view
+
+
+def send_frame(sock, body):
+    sock.sendall(FRAME_HEADER.pack(len(body)) + body)
+
+
+def recv_frame(sock):
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {size} bytes exceeds limit")
+    if size == 0:
+        return b""
+    body = recv_exact(sock, size)
+    if body is None:
+        raise ProtocolError("Connection closed before frame body")
+    return bytes(body)
+
+
+def send_text(sock, text):
+    send_frame(sock, text.encode("utf-8"))
+
+
+def recv_text(sock):
+    body = recv_frame(sock)
+    if body is None:
+        return None
+    return body.decode("utf-8")
+
+
+def encode_route(hops):
+    parts = []
+    for node, arrived, departed, next_hop, distance in hops or ():
+        name, next_name = node.encode("utf-8"), (next_hop or "").encode("utf-8")
+        if len(name) > 255 or len(next_name) > 255:
+            raise ProtocolError("Node name too long for the route header")
+        #struct caches the format for each pair of name lengths
+        parts.append(struct.pack(
+            f"!B{len(name)}sddfB{len(next_name)}s", len(name), name,
+            math.nan if arrived is None else arrived,
+            math.nan if departed is None else departed,
+            math.nan if distance is None else distance,
+            len(next_name), next_name,
+        ))
+    return b"".join(parts)
+
+
+def decode_route(route):
+    #registry requests and other envelopes without a trace have an empty route
+    hops = []
+    offset = 0
+    try:
+        while offset < len(route):
+            end = offset + 1 + route[offset]
+            node = route[offset + 1:end].decode("utf-8")
+            arrived, departed, distance = HOP_TIMES.unpack_from(route, end)
+            offset = end + HOP_TIMES.size
+            end = offset + 1 + route[offset]
+            #NaN is the only value not equal to itself
+            hops.append([
+                node,
+                None if arrived != arrived else arrived,
+                None if departed != departed else departed,
+                route[offset + 1:end].decode("utf-8") or None,
+                None if distance != distance else distance,
+            ])
+            offset = end
+    except (IndexError, UnicodeDecodeError, struct.error) as e:
+        raise ProtocolError(f"Invalid route header: {e}") from e
+    if offset != len(route):
+        raise ProtocolError("Invalid route header: truncated record")
+    return hops
+
+
+def envelope_parts(message):
+    #buffers making up an envelope body, for a full message or a relayed payload
+    route = encode_route(message.get("hops"))
+    head = ROUTE_HEADER.pack(len(route)) + route
+    if "payload" in message:
+        return [head, message["payload"]]
+    iv, tag = message["iv"], message["tag"]
+    if len(iv) != IV_SIZE or len(tag) != TAG_SIZE:
+        raise ProtocolError("Invalid iv or tag size")
+    return [head, iv, tag, message["encrypted_data"]]
+
+
+def envelope_size(message):
+    #bytes the envelope takes on the wire, frame header included
+    return FRAME_HEADER.size + sum(len(part) for part in envelope_parts(message))
+
+
+def pack_envelope(message):
+    return b"".join(envelope_parts(message))
+
+
+def split_envelope(body):
+    #route and opaque iv/tag/ciphertext payload as a view into body, without copying it
+    view = memoryview(body)
+    if len(view) < ROUTE_HEADER.size:
+        raise ProtocolError("Envelope too short")
+    (route_size,) = ROUTE_HEADER.unpack_from(view)
+    offset = ROUTE_HEADER.size + route_size
+    if len(view) < offset + IV_SIZE + TAG_SIZE:
+        raise ProtocolError("Envelope too short")
+    return {
+        "hops": decode_route(bytes(view[ROUTE_HEADER.size:offset])),
+        "payload": view[offset:],
+    }
+
+
+def unpack_envelope(body):
+    if len(body) < ROUTE_HEADER.size:
+        raise ProtocolError("Envelope too short")
+    (route_size,) = ROUTE_HEADER.unpack_from(body)
+    offset = ROUTE_HEADER.size + route_size
+    if len(body) < offset + IV_SIZE + TAG_SIZE:
+        raise ProtocolError("Envelope too short")
+    return {
+        "hops": decode_route(bytes(body[ROUTE_HEADER.size:offset])),
+        "iv": bytes(body[offset:offset + IV_SIZE]),
+        "tag": bytes(body[offset + IV_SIZE:offset + IV_SIZE + TAG_SIZE]),
+        "encrypted_data": bytes(body[offset + IV_SIZE + TAG_SIZE:]),
+    }
+
+
+def send_envelope(sock, message):
+    parts = envelope_parts(message)
+    size = sum(len(part) for part in parts)
+    send_buffers(sock, [FRAME_HEADER.pack(size)] + parts)
+
+
+def recv_envelope(sock):
+    body = recv_frame(sock)
+    if body is None:
+        return None
+    return unpack_envelope(body)
+
+
+# asyncio stream versions of the helpers above. Writers only buffer, callers
+# await writer.drain() when they need backpressure.
+
+async def read_frame(reader):
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ProtocolError("Connection closed mid frame header")
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {size} bytes exceeds limit")
+    try:
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("Connection closed before frame body")
+
+
+def write_frame(writer, body):
+    writer.write(FRAME_HEADER.pack(len(body)) + body)
+
+
+async def read_text(reader):
+    body = await read_frame(reader)
+    if body is None:
+        return None
+    return body.decode("utf-8")
+
+
+def write_text(writer, text):
+    write_frame(writer, text.encode("utf-8"))
+
+
+async def read_envelope(reader):
+    body = await read_frame(reader)
+    if body is None:
+        return None
+    return unpack_envelope(body)
+
+
+def write_envelope(writer, message):
+    parts = envelope_parts(message)
+    writer.writelines([FRAME_HEADER.pack(sum(len(part) for part in parts))] + parts)
@@ -0,0 +1,209 @@
+import math
+import threading
+
+import numpy as np
+
+from utils.clock import SYSTEM_CLOCK
+from utils.orbit import EARTH_RADIUS, GROUND_RANGE_KM, SPEED_OF_LIGHT, haversine_np
+from utils.spatial_index import KDTree, surface_to_chord, unit_vectors
+
+# Shortest path routing toward the ground station.
+#
+# For one time slice the constellation is turned into a link graph: two
+# satellites are linked when they are within isl_range_km of each other, and a
+# satellite sees the ground station when it is within ground_range_km. Edges
+# cost their light time plus a fixed hop_latency per hop, so a slightly longer
+# path with fewer relays wins over a chain of short hops.
+#
+# One Dijkstra run from the ground station gives every satellite its latency
+# to the ground and, as its predecessor in the shortest path tree, its next
+# hop. Orbits are deterministic, so every satellite computes the same table
+# from its own constellation view and next hops agree without exchanging
+# tables. Building a table takes a while for large constellations, so tables
+# are built ahead of their slice on a background thread, never while a
+# message waits for its next hop.
+
+GROUND_STATION = -1
+NO_ROUTE = -2
+
+
+class RouteTable:
+    # Next hop per satellite for the time slice starting at t
+
+    def __init__(self, orbits, t, ground_lat, ground_long, isl_range_km, ground_range_km, hop_latency):
+        self.orbits = orbits
+        self.t = t
+        n = len(orbits)
+        self.index_by_addr = {s["addr"]: i for i, s in enumerate(orbits.satellites)}
+
+        #next_hop[i] is a satellite index, GROUND_STATION or NO_ROUTE
+        self.next_hop = np.full(n, NO_ROUTE, dtype=int)
+        self.link_km = np.full(n, np.inf)
+        self.latency = np.full(n, np.inf)
+        self.hops = np.zeros(n, dtype=int)
+        if n == 0:
+            return
+
+        lat, long = orbits.positions(t)
+        ground_km = haversine_np(lat, long, ground_lat, ground_long)
+
+        ground = np.flatnonzero(ground_km <= ground_range_km)
+        self.latency[ground] = ground_km[ground] / SPEED_OF_LIGHT + hop_latency
+        self.next_hop[ground] = GROUND_STATION
+        self.link_km[ground] = ground_km[ground]
+        self.hops[ground] = 1
+
+        #array form of Dijkstra: each step settles the closest unsettled
+        #satellite and relaxes its links. Links are pruned with the KD-tree:
+        #one radius query per leaf, widened by the leaf's extent, gives the
+        #candidates within isl_range_km of any satellite in the leaf
+        points = unit_vectors(lat, long)
+        tree = KDTree(points, leaf_size=128)
+        radius = surface_to_chord(isl_range_km)
+        min_dot = math.cos(min(isl_range_km / EARTH_RADIUS, math.pi))
+        candidates = [None] * n
+        for members in tree.leaves():
+            centre = points[members].mean(axis=0)
+            extent = float(np.sqrt(((points[members] - centre) ** 2).sum(axis=1)).max())
+            near = tree.query_radius(centre, radius + extent)
+            entry = (near, points[near])
+            for i in members.tolist():
+                candidates[i] = entry
+
+        pending = self.latency.copy()
+        for _ in range(n):
+            u = int(np.argmin(pending))
+            if not np.isfinite(pending[u]):
+                break
+            pending[u] = np.inf
+            near, near_points = candidates[u]
+            dot = near_points @ points[u]
+            linked = dot >= min_dot
+            near = near[linked]
+            km = EARTH_RADIUS * np.arccos(np.minimum(dot[linked], 1.0))
+            candidate = km / SPEED_OF_LIGHT + (self.latency[u] + hop_latency)
+            better = candidate < self.latency[near]
+            near, candidate = near[better], candidate[better]
+            self.latency[near] = candidate
+            pending[near] = candidate
+            self.next_hop[near] = u
+            self.link_km[near] = km[better]
+            self.hops[near] = self.hops[u] + 1
+
+    def lookup(self, addr):
+        #(next hop, link distance in km) for the satellite at addr, None without a route
+        i = self.index_by_addr.get(addr)
+        if i is None or self.next_hop[i] == NO_ROUTE:
+            return None
+        return int(self.next_hop[i]), float(self.link_km[i])
+
+
+class RoutingEngine:
+    # Route tables for a ConstellationView, one per time slice of
+    # slice_seconds.
+    #
+    # A builder thread builds the table of the current slice and of the next
+    # one, then sleeps until the next slice starts or the constellation
+    # changes; finished tables are swapped in under the lock. Lookups never
+    # build: while there is no table for their slice and the current
+    # constellation, next_hop returns None and satellites fall back to the
+    # closest node. With background=False, for the discrete-event simulation
+    # where time only moves between events, the first lookup of a slice
+    # builds its table instead.
+
+    def __init__(self, constellation, ground_lat, ground_long, slice_seconds=1.0,
+                 isl_range_km=5000.0, ground_range_km=GROUND_RANGE_KM, hop_latency=0.001,
+                 clock=SYSTEM_CLOCK, background=True):
+        self.constellation = constellation
+        self.ground_lat = ground_lat
+        self.ground_long = ground_long
+        self.slice_seconds = slice_seconds
+        self.isl_range_km = isl_range_km
+        self.ground_range_km = ground_range_km
+        self.hop_latency = hop_latency
+        self.clock = clock
+        self.background = background
+        #slice start -> RouteTable, replaced as a whole so readers never see a partial update
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.changed = False
+        self.running = True
+        self.builder = None
+
+    def slice_start(self, t):
+        return math.floor(t / self.slice_seconds) * self.slice_seconds
+
+    def build(self, orbits, t):
+        return RouteTable(
+            orbits, t, self.ground_lat, self.ground_long,
+            self.isl_range_km, self.ground_range_km, self.hop_latency,
+        )
+
+    def table(self, t):
+        #table of the slice containing t, None while the builder has not finished it
+        orbits = self.constellation.orbit_arrays()
+        start = self.slice_start(t)
+        with self.lock:
+            table = self.tables.get(start)
+            if table is not None and table.orbits is orbits:
+                return table
+            if not self.background:
+                table = self.build(orbits, start)
+                self.tables = {start: table}
+                return table
+            if self.running and self.builder is None:
+                self.constellation.add_listener(self.on_constellation_change)
+                self.builder = threading.Thread(target=self.run, daemon=True)
+                self.builder.start()
+            self.changed = True
+            self.wakeup.notify()
+            return None
+
+    def on_constellation_change(self, event, satellite):
+        with self.lock:
+            self.changed = True
+            self.wakeup.notify()
+
+    def run(self):
+        while True:
+            orbits = self.constellation.orbit_arrays()
+            start = self.slice_start(self.clock.time())
+            with self.lock:
+                if not self.running:
+                    return
+                self.changed = False
+            for t in (start, start + self.slice_seconds):
+                with self.lock:
+                    table = self.tables.get(t)
+                if table is not None and table.orbits is orbits:
+                    continue
+                #skip a slice that ended while the previous table was built
+                if t + self.slice_seconds <= self.clock.time():
+                    continue
+                table = self.build(orbits, t)
+                with self.lock:
+                    tables = {k: v for k, v in self.tables.items() if k >= self.slice_start(self.clock.time())}
+                    tables[t] = table
+                    self.tables = tables
+            with self.lock:
+                if self.running and not self.changed:
+                    self.wakeup.wait(max(0.0, start + self.slice_seconds - self.clock.time()))
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.wakeup.notify()
+
+    def next_hop(self, addr, t):
+        #(satellite dict or None for the ground station, distance in km), None without a route
+        table = self.table(t)
+        if table is None:
+            return None
+        route = table.lookup(addr)
+        if route is None:
+            return None
+        hop, distance = route
+        if hop == GROUND_STATION:
+            return None, distance
+        return table.orbits.satellites[hop], distance
@@ -0,0 +1,152 @@
+from collections import deque
+
+# Per-device sequence tracking on the trackers' "Message Order".
+#
+# Trackers resend queued readings after a reconnect and satellites acknowledge
+# a message before the next hop has it, so the ground station sees duplicates
+# and readings out of order. DuplicateFilter drops readings it has already
+# seen, ReorderBuffer optionally releases each device's readings in order.
+# Both keep a few fixed-size entries per device and do constant work per
+# reading, whatever the number of devices.
+
+NEW = "new"
+DUPLICATE = "duplicate"
+#older than the window, cannot be told apart from a duplicate and is let through
+LATE = "late"
+#the device started counting again, e.g. a tracker restarted without its queue
+RESTARTED = "restarted"
+
+
+class DuplicateFilter:
+    # Sliding window over the last `window` sequence numbers of each device,
+    # as in IPsec replay protection: the highest number seen and a bitmap (a
+    # Python int) where bit i is set when number highest - i has arrived.
+    # Checking a reading is a shift and a mask. A lower number carrying a newer
+    # timestamp than the highest one can only come from a tracker that started
+    # counting again, and the window starts over.
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.mask = (1 << window) - 1
+        #device -> [highest number, bitmap, timestamp of the highest number]
+        self.devices = {}
+
+    def __len__(self):
+        return len(self.devices)
+
+    def check(self, device, order, timestamp=None):
+        state = self.devices.get(device)
+        if state is None:
+            self.devices[device] = [order, 1, timestamp]
+            return NEW
+        highest, seen, highest_timestamp = state
+        if order > highest:
+            shift = order - highest
+            state[0] = order
+            state[1] = ((seen << shift) | 1) & self.mask if shift < self.window else 1
+            state[2] = timestamp
+            return NEW
+        if timestamp is not None and highest_timestamp is not None and timestamp > highest_timestamp:
+            self.devices[device] = [order, 1, timestamp]
+            return RESTARTED
+        offset = highest - order
+        if offset >= self.window:
+            return LATE
+        bit = 1 << offset
+        if seen & bit:
+            return DUPLICATE
+        state[1] = seen | bit
+        return NEW
+
+
+class ReorderBuffer:
+    # Releases each device's readings in sequence order through emit(item).
+    #
+    # A reading after a gap waits until the gap is filled, for at most
+    # max_wait seconds and with at most max_items readings waiting per device;
+    # past either limit the missing numbers are given up on and the lowest
+    # waiting reading is released. Readings below the next expected number
+    # (given up on, or older than the first one seen) are released at once.
+    # Deadlines are kept in arrival order in one deque, so expiring them is
+    # amortized constant work per reading. push() expires what is due, the
+    # owner also calls expire() on a timer so a quiet device's readings are
+    # not held forever.
+
+    def __init__(self, emit, max_items=64, max_wait=10.0):
+        self.emit = emit
+        self.max_items = max_items
+        self.max_wait = max_wait
+        #device -> next number to release
+        self.expected = {}
+        #device -> {number: item}, only for devices with a gap
+        self.pending = {}
+        self.deadlines = deque()
+        self.buffered = 0
+        #numbers given up on
+        self.skipped = 0
+
+    def __len__(self):
+        return self.buffered
+
+    def push(self, device, order, item, now):
+        self.expire(now)
+        expected = self.expected.get(device)
+        if expected is None or order == expected:
+            self.emit(item)
+            self.expected[device] = order + 1
+            self.release(device)
+        elif order < expected:
+            self.emit(item)
+        else:
+            pending = self.pending.setdefault(device, {})
+            if order in pending:
+                #a duplicate, when nothing filters them out before
+                return
+            pending[order] = item
+            self.buffered += 1
+            self.deadlines.append((now + self.max_wait, device, order))
+            if len(pending) > self.max_items:
+                self.skip(device)
+
+    def release(self, device):
+        #emit the waiting readings that became consecutive
+        pending = self.pending.get(device)
+        if not pending:
+            return
+        expected = self.expected[device]
+        while expected in pending:
+            self.emit(pending.pop(expected))
+            self.buffered -= 1
+            expected += 1
+        self.expected[device] = expected
+        if not pending:
+            del self.pending[device]
+
+    def skip(self, device):
+        #stop waiting for the gap below the lowest waiting number, at most max_items to look at
+        lowest = min(self.pending[device])
+        self.skipped += lowest - self.expected[device]
+        self.expected[device] = lowest
+        self.release(device)
+
+    def expire(self, now):
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, device, order = self.deadlines.popleft()
+            #the entry is stale when the reading was released already
+            while order in self.pending.get(device, ()):
+                self.skip(device)
+
+    def reset(self, device):
+        #release what waits for device in order and start over with its next reading
+        pending = self.pending.pop(device, {})
+        for order in sorted(pending):
+            self.emit(pending[order])
+        self.buffered -= len(pending)
+        self.expected.pop(device, None)
+        #a restarted device reuses numbers, an old deadline must not expire a new reading
+        if pending:
+            self.deadlines = deque(entry for entry in self.deadlines if entry[1] != device)
+
+    def flush(self):
+        for device in list(self.pending):
+            self.reset(device)
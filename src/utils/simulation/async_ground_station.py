@@ -0,0 +1,105 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.simulation.ground_station import GroundStationReceiver
+from utils.protocol import read_envelope, write_text
+from utils.clock import SYSTEM_CLOCK
+from utils.log import get_logger
+from utils import metrics
+
+log = get_logger("ground_station")
+
+QUEUE_DEPTH = metrics.gauge("ground_station_queue_depth", "Envelopes waiting for a decrypt worker")
+
+
+class AsyncGroundStationReceiver(GroundStationReceiver):
+    # Ground station with an asyncio front end. Connections only read frames
+    # and write acks; decrypting, validating and logging run in a bounded pool
+    # of worker threads fed by a bounded queue. When the queue is full the
+    # connection handlers stop reading, which pushes back on the satellites
+    # through TCP flow control instead of growing memory.
+
+    def __init__(self, host, port, workers=4, queue_size=1000, report_interval=10.0, store_path="data/telemetry.db",
+                 clock=SYSTEM_CLOCK, dedup_window=1024, reorder_size=0, reorder_wait=10.0):
+        super().__init__(
+            host, port, store_path, clock,
+            dedup_window=dedup_window, reorder_size=reorder_size, reorder_wait=reorder_wait,
+        )
+        self.workers = workers
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.processed = 0
+
+    async def worker(self, queue, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            message, ack = await queue.get()
+            try:
+                result = await loop.run_in_executor(executor, self.process_message, message)
+                ack.set_result(result)
+            except Exception as e:
+                ack.set_result("Error: Decryption failed")
+                log.error(f"[Ground Station] Error in worker: {e}")
+            self.processed += 1
+            queue.task_done()
+
+    async def report_ingest_rate(self, queue):
+        last_count, last_time = 0, time.monotonic()
+        while True:
+            await asyncio.sleep(self.report_interval)
+            now = time.monotonic()
+            rate = (self.processed - last_count) / (now - last_time)
+            log.info(
+                f"[Ground Station] Ingest rate: {rate:.1f} msg/s, queue depth: {queue.qsize()}/{self.queue_size}",
+                extra={"fields": {"ingest_rate": rate, "queue_depth": queue.qsize()}},
+            )
+            last_count, last_time = self.processed, now
+
+    async def handle_tracker_async(self, reader, writer, queue):
+        addr = writer.get_extra_info("peername")
+        loop = asyncio.get_running_loop()
+        log.info(f"[Ground Station] Connection established with {addr}")
+        try:
+            while True:
+                message = await read_envelope(reader)
+                if message is None:
+                    log.info(f"[Ground Station] Connection closed by {addr}")
+                    break
+
+                ack = loop.create_future()
+                #waits while the queue is full
+                await queue.put((message, ack))
+                write_text(writer, await ack)
+                await writer.drain()
+        except (OSError, ValueError) as e:
+            log.warning(f"[Ground Station] Connection error with {addr}: {e}")
+        finally:
+            writer.close()
+
+    async def serve(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        QUEUE_DEPTH.set_function(queue.qsize)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            tasks = [asyncio.create_task(self.worker(queue, executor)) for _ in range(self.workers)]
+            tasks.append(asyncio.create_task(self.report_ingest_rate(queue)))
+
+            server = await asyncio.start_server(
+                lambda r, w: self.handle_tracker_async(r, w, queue), self.host, self.port
+            )
+            log.info(f"[Ground Station] Listening on {self.host}:{self.port} "
+                  f"(asyncio, {self.workers} workers, queue size {self.queue_size})")
+            try:
+                async with server:
+                    await server.serve_forever()
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    def listen_for_data(self):
+        self.start_reorder_expiry()
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            log.info("[Ground Station] Shutting down gracefully")
+            self.close_store()
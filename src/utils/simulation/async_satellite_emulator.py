@@ -0,0 +1,197 @@
+import time
+import asyncio
+
+from utils.simulation.satellite_emulator import (
+    SatelliteEmulator, MESSAGES_IN, BYTES_IN, MESSAGES_OUT, BYTES_OUT, HOP_LATENCY, IN_FLIGHT,
+)
+from utils.protocol import read_frame, split_envelope, write_envelope, read_text, write_text, envelope_size, FRAME_HEADER
+from utils.clock import SYSTEM_CLOCK
+from utils.encryption import USE_CHECKSUM
+from utils.trace import arrive, depart, path_string
+from utils.log import get_logger
+from ip_config import ground_station_host, ground_station_port
+
+log = get_logger("satellite")
+
+
+class AsyncSatelliteEmulator(SatelliteEmulator):
+    # Satellite relay on a single asyncio event loop instead of one thread per
+    # connection. Registration, next hop selection and deregistration are the
+    # same as SatelliteEmulator; accept, decode, propagation delay, forward and
+    # ack are coroutines, so a waiting message costs a task, not a thread. As in
+    # the threaded relay, a message is acknowledged once its handover task is
+    # started, not when the next hop has it.
+
+    def __init__(self, device_name, host, port, ground_ip, ground_port, max_idle_per_addr=4,
+                 buffer_size=1000, buffer_dir=None, flush_interval=5.0, routing="table", clock=SYSTEM_CLOCK,
+                 checksum=USE_CHECKSUM):
+        super().__init__(
+            device_name, host, port, ground_ip, ground_port,
+            buffer_size=buffer_size, buffer_dir=buffer_dir, flush_interval=flush_interval, routing=routing,
+            clock=clock, checksum=checksum,
+        )
+        self.max_idle_per_addr = max_idle_per_addr
+        #idle (reader, writer) pairs per destination addr, only touched from the loop
+        self.idle_connections = {}
+        self.loop = None
+        self.flush_wakeup = None
+        #handover tasks of messages in the air, referenced until they finish
+        self.relays = set()
+        IN_FLIGHT.set_function(lambda: len(self.relays))
+
+    async def acquire(self, addr):
+        idle = self.idle_connections.get(addr, [])
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        h, p = addr.split(":")
+        return await asyncio.open_connection(h, int(p))
+
+    def release(self, addr, connection):
+        idle = self.idle_connections.setdefault(addr, [])
+        if len(idle) < self.max_idle_per_addr:
+            idle.append(connection)
+        else:
+            connection[1].close()
+
+    def evict(self, addr):
+        for _, writer in self.idle_connections.pop(addr, []):
+            writer.close()
+
+    def on_constellation_change(self, event, satellite):
+        super().on_constellation_change(event, satellite)
+        if event == "deregister" and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.evict, satellite["addr"])
+
+    def request_flush(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.flush_wakeup.set)
+
+    async def flush_buffer_async(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_wakeup.wait(), self.flush_wait())
+            except asyncio.TimeoutError:
+                pass
+            self.flush_wakeup.clear()
+
+            #hand over buffered messages oldest first, stop at the first failure
+            sent = 0
+            message = self.buffer.take()
+            while message is not None:
+                try:
+                    await self.handover_data_async(message)
+                except Exception as e:
+                    self.buffer.retry()
+                    log.warning(f"[{self.device_name}] Next hop still unreachable, {self.buffer.qsize()} messages buffered: {e}")
+                    break
+                self.buffer.delivered()
+                sent += 1
+                message = self.buffer.take()
+            if sent:
+                log.info(f"[{self.device_name}] Flushed {sent} buffered messages")
+
+    async def forward(self, addr, data):
+        reader, writer = await self.acquire(addr)
+        try:
+            write_envelope(writer, data)
+            await writer.drain()
+            ack = await read_text(reader)
+        except BaseException:
+            writer.close()
+            raise
+        self.release(addr, (reader, writer))
+        return ack
+
+    async def handover_data_async(self, data):
+        closest_position, min_distance = self.next_hop(data)
+        depart(data["hops"], self.clock.time(), closest_position["device_name"], min_distance)
+
+        log.info(
+            "[%s] Forwarding %s to %s (%.2f km)",
+            self.device_name, path_string(data["hops"]), closest_position["device_name"], min_distance,
+            extra={"fields": {"next_hop": closest_position["device_name"], "distance_km": min_distance}},
+        )
+
+        #simulate delay based on distance without holding a thread
+        await asyncio.sleep(min_distance / 299_792.458)
+
+        if closest_position["device_name"] == 'GroundStation':
+            addr = f"{ground_station_host}:{ground_station_port}"
+        else:
+            addr = closest_position["addr"]
+        ack = await self.forward(addr, data)
+        MESSAGES_OUT.labels("ground_station" if closest_position["device_name"] == 'GroundStation' else "satellite").inc()
+        BYTES_OUT.inc(envelope_size(data))
+        if ack:
+            log.debug("[%s] Received acknowledgment from %s: %s", self.device_name, closest_position["device_name"], ack)
+
+    async def relay(self, message, received):
+        #one message's handover as its own task, the sender has its ack already
+        try:
+            await self.handover_data_async(message)
+        except asyncio.CancelledError:
+            #shutting down, the buffer keeps it (and spills it to --buffer-dir)
+            self.buffer.put(message)
+            raise
+        except Exception as e:
+            log.debug("[%s] Handover failed: %s", self.device_name, e)
+            self.store_message(message)
+            return
+        HOP_LATENCY.observe(time.monotonic() - received)
+        #the path works again, deliver what piled up meanwhile
+        if not self.buffer.empty():
+            self.flush_wakeup.set()
+
+    async def handle_tracker_async(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        log.info(f"[{self.device_name}] Connection established with {addr}")
+        try:
+            while True:
+                body = await read_frame(reader)
+                if body is None:
+                    log.info(f"[{self.device_name}] Connection closed by {addr}")
+                    break
+
+                MESSAGES_IN.inc()
+                BYTES_IN.inc(FRAME_HEADER.size + len(body))
+                received = time.monotonic()
+
+                #relays never decrypt, the payload stays a view into the frame
+                message = split_envelope(body)
+
+                arrive(message["hops"], self.device_name, self.clock.time())
+                log.debug("[%s] Received data, Message Travel Path: %s", self.device_name, path_string(message["hops"]))
+
+                task = asyncio.create_task(self.relay(message, received))
+                self.relays.add(task)
+                task.add_done_callback(self.relays.discard)
+                ack_message = f"Data received and forwarded at {self.clock.time()}"
+
+                write_text(writer, ack_message)
+                await writer.drain()
+        except (OSError, ValueError) as e:
+            log.warning(f"[{self.device_name}] Connection error with {addr}: {e}")
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.flush_wakeup = asyncio.Event()
+        flusher = asyncio.create_task(self.flush_buffer_async())
+        server = await asyncio.start_server(self.handle_tracker_async, self.host, self.port)
+        log.info(f"[{self.device_name}] Listening on {self.host}:{self.port} (asyncio)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            flusher.cancel()
+
+    def listen_for_data(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            self.deregister_from_network()
+            log.info("[Satellite] Shutting down gracefully")
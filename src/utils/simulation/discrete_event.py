@@ -0,0 +1,214 @@
+import heapq
+import itertools
+import random
+import time
+
+import numpy as np
+
+from utils.encryption import SECRET_KEY
+from utils.crypto import seal
+from utils.protocol import pack_envelope, split_envelope, unpack_envelope
+from utils.clock import VirtualClock
+from utils.constellation import ConstellationView
+from utils.routing import RoutingEngine
+from utils.contact_plan import ContactPlanner
+from utils.orbit import SPEED_OF_LIGHT
+from utils.trace import start_trace, arrive, depart, path_string, relays
+from utils.simulation.satellite_network import SatelliteNetwork
+from utils.simulation.satellite_emulator import SatelliteEmulator
+from utils.simulation.ground_station import GroundStationReceiver
+from utils.log import get_logger
+from bird_tracker import BirdTracker
+from marine_animal_tracker import MarineAnimalTracker
+from terrestrial_animal_tracker import TerrestrialAnimalTracker
+from ip_config import (
+    registration_server_host, registration_server_port, ground_station_host, ground_station_port,
+)
+
+log = get_logger("simulation")
+
+TRACKER_TYPES = (BirdTracker, MarineAnimalTracker, TerrestrialAnimalTracker)
+
+
+class EventLoop:
+    # Pending events ordered by time on a VirtualClock. Running an event first
+    # moves the clock to its time, so nothing ever waits for real time.
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.events = []
+        #ties run in the order they were scheduled
+        self.sequence = itertools.count()
+        self.processed = 0
+
+    def __len__(self):
+        return len(self.events)
+
+    def schedule_at(self, t, callback, *args):
+        heapq.heappush(self.events, (t, next(self.sequence), callback, args))
+
+    def schedule(self, delay, callback, *args):
+        self.schedule_at(self.clock.time() + delay, callback, *args)
+
+    def run(self, until=None):
+        #run events in time order, up to and including time until
+        while self.events:
+            t, _, callback, args = self.events[0]
+            if until is not None and t > until:
+                break
+            heapq.heappop(self.events)
+            self.clock.advance_to(t)
+            callback(*args)
+            self.processed += 1
+        if until is not None and until > self.clock.time():
+            self.clock.advance_to(until)
+
+
+class DiscreteEventSimulation:
+    # The registry, satellites, trackers and ground station of one scenario in
+    # a single process on a VirtualClock. The components are the regular
+    # classes sharing one ConstellationView; only the sockets and sleeps
+    # between them become events, a message arriving distance / speed of light
+    # after it was sent. Envelopes are packed and parsed as on the wire and the
+    # ground station decrypts, validates, logs and stores every reading, so a
+    # day of traffic takes minutes and yields the metrics of a wall-clock run.
+
+    def __init__(self, satellites=10, counts=(1, 1, 1), report_interval=6.0, routing="table",
+                 store_path=None, start=None, seed=None):
+        if seed is not None:
+            random.seed(seed)
+        self.clock = VirtualClock(start)
+        self.loop = EventLoop(self.clock)
+        self.report_interval = report_interval
+
+        #in-process registry, the view is fed its snapshot instead of subscribing over TCP
+        self.network = SatelliteNetwork(registration_server_host, registration_server_port)
+        self.constellation = ConstellationView(registration_server_host, registration_server_port, name="Simulation")
+        self.satellites = {}
+        for i in range(satellites):
+            satellite = SatelliteEmulator(
+                f"Satellite{i}", "127.0.0.1", 7000 + i, ground_station_host, ground_station_port,
+                routing=routing, clock=self.clock,
+            )
+            addr = f"{satellite.host}:{satellite.port}"
+            self.satellites[addr] = satellite
+            self.network.register({"device_name": satellite.device_name, "addr": addr, "orbit": satellite.orbit})
+        with self.network.lock:
+            self.constellation.apply(self.network.snapshot())
+
+        #every satellite routes on the same tables, built once per time slice when the
+        #simulation reaches it, there is no wall time for a background builder to use
+        routing_engine = RoutingEngine(
+            self.constellation, satellite.ground_lat, satellite.ground_long, clock=self.clock, background=False
+        )
+        contacts = ContactPlanner(
+            self.constellation, satellite.ground_lat, satellite.ground_long, clock=self.clock, background=False
+        )
+        for satellite in self.satellites.values():
+            satellite.attach_constellation(self.constellation, routing_engine, contacts)
+
+        self.trackers = []
+        for tracker_type, count in zip(TRACKER_TYPES, counts):
+            for i in range(count):
+                self.trackers.append(tracker_type(
+                    f"{tracker_type.__name__}Device{i}", "127.0.0.1", None,
+                    clock=self.clock, constellation=self.constellation,
+                ))
+
+        #the per-node breakdown is logged once at the end and returned in the summary
+        self.ground_station = GroundStationReceiver(
+            ground_station_host, ground_station_port, store_path, clock=self.clock, hop_report_interval=float("inf")
+        )
+
+        self.sent = 0
+        self.latencies = []
+        self.hops = []
+
+    def report(self, tracker):
+        #one reading of WildLifeTracker.run and sender_thread
+        tracker.collect_data()
+        data = tracker.message_queue.get_nowait()
+        data["restored"] = False
+        message = seal(data, SECRET_KEY, tracker.checksum)
+        satellite = tracker.closest_satellite()
+        message["hops"] = start_trace(
+            tracker.device_name, self.clock.time(), satellite["device_name"], tracker.satellite_distance
+        )
+        tracker.message_queue.task_done()
+        self.sent += 1
+
+        self.loop.schedule(
+            tracker.delay_message, self.receive, self.satellites[satellite["addr"]], pack_envelope(message), data["timestamp"]
+        )
+        self.loop.schedule(self.report_interval, self.report, tracker)
+
+    def receive(self, satellite, body, sent_at):
+        #SatelliteEmulator.handle_tracker and handover_data for one envelope
+        message = split_envelope(body)
+        arrive(message["hops"], satellite.device_name, self.clock.time())
+        hop, distance = satellite.next_hop(message)
+        depart(message["hops"], self.clock.time(), hop["device_name"], distance)
+        log.debug(
+            "[%s] Forwarding %s to %s (%.2f km)",
+            satellite.device_name, path_string(message["hops"]), hop["device_name"], distance,
+        )
+
+        body = pack_envelope(message)
+        if hop["device_name"] == "GroundStation":
+            self.loop.schedule(distance / SPEED_OF_LIGHT, self.deliver, body, sent_at)
+        else:
+            self.loop.schedule(distance / SPEED_OF_LIGHT, self.receive, self.satellites[hop["addr"]], body, sent_at)
+
+    def deliver(self, body, sent_at):
+        message = unpack_envelope(body)
+        ack = self.ground_station.process_message(message)
+        if ack.startswith("Data received"):
+            self.latencies.append(self.clock.time() - sent_at)
+            self.hops.append(relays(message["hops"]))
+
+    def run(self, duration):
+        start = self.clock.time()
+        #trackers are not started at the same instant, spread the first readings
+        for tracker in self.trackers:
+            self.loop.schedule(random.uniform(0, self.report_interval), self.report, tracker)
+
+        log.info(
+            f"[Simulation] {len(self.satellites)} satellites, {len(self.trackers)} trackers, "
+            f"{duration:.0f} simulated seconds"
+        )
+        wall_start = time.perf_counter()
+        self.loop.run(until=start + duration)
+        wall_time = time.perf_counter() - wall_start
+        self.ground_station.close_store()
+
+        summary = self.summary(duration, wall_time)
+        log.info(
+            "[Simulation] %d readings sent, %d delivered, latency mean %.6f s p50 %.6f s p95 %.6f s p99 %.6f s, "
+            "%.2f hops on average, %.0f simulated seconds in %.2f s (%.0fx)",
+            summary["sent"], summary["delivered"], summary["latency_mean"], summary["latency_p50"],
+            summary["latency_p95"], summary["latency_p99"], summary["hops_mean"],
+            summary["simulated_seconds"], summary["wall_seconds"], summary["speedup"],
+            extra={"fields": summary},
+        )
+        return summary
+
+    def summary(self, duration, wall_time):
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        hops = np.array(self.hops) if self.hops else np.zeros(1)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        return {
+            "sent": self.sent,
+            "delivered": len(self.latencies),
+            "latency_mean": float(latencies.mean()),
+            "latency_p50": float(p50),
+            "latency_p95": float(p95),
+            "latency_p99": float(p99),
+            "hops_mean": float(hops.mean()),
+            "hops_max": int(hops.max()),
+            "events": self.loop.processed,
+            "simulated_seconds": duration,
+            "wall_seconds": wall_time,
+            "speedup": duration / wall_time if wall_time else float("inf"),
+            #residence and link latency per satellite, from the hop records
+            "nodes": self.ground_station.hop_stats.summary(),
+        }
@@ -0,0 +1,229 @@
+import math
+import time
+import queue
+import random
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from utils.encryption import SECRET_KEY, USE_CHECKSUM
+from utils.crypto import seal
+from utils.protocol import send_envelope, recv_text
+from utils.connection_pool import ConnectionPool
+from utils.constellation import ConstellationView
+from utils.orbit import haversine_np
+from utils.trace import start_trace
+from utils.log import get_logger
+from ip_config import registration_server_host, registration_server_port
+
+log = get_logger("fleet")
+
+# Tracker types with the ranges of BirdTracker, MarineAnimalTracker and
+# TerrestrialAnimalTracker: (name prefix, heart rate range, body temperature
+# range, altitude kind)
+TRACKER_KINDS = (
+    ("BirdTrackerDevice", (100, 600), (39.0, 43.0), "height"),
+    ("MarineAnimalTrackerDevice", (20, 40), (36.0, 39.0), "depth"),
+    ("TerrestrialAnimalTrackerDevice", (20, 90), (36.0, 39.0), None),
+)
+
+
+class FleetSimulator:
+    # Many trackers in one process. The state of every tracker lives in NumPy
+    # arrays and each tick advances all trackers that are due for a reading
+    # with the random walk of WildLifeTracker.collect_data and the subclasses.
+    # Readings are grouped by closest satellite, packed into batched uplink
+    # messages and sent by a few sender threads over pooled connections,
+    # instead of one process, socket and registry session per animal.
+
+    def __init__(self, counts, connections=4, batch_size=100, report_interval=6.0, tick=1.0,
+                 max_pending=1000, seed=None, checksum=USE_CHECKSUM):
+        self.rng = np.random.default_rng(seed)
+        self.batch_size = batch_size
+        self.report_interval = report_interval
+        self.tick = tick
+        self.connections = connections
+        #add a SHA-256 checksum to every uplink on top of the AES-GCM tag
+        self.checksum = checksum
+
+        self.kind = np.repeat(np.arange(len(TRACKER_KINDS)), counts)
+        n = len(self.kind)
+        suffix = random.randint(1, 1000)
+        self.names = [
+            f"{TRACKER_KINDS[k][0]}Fleet{suffix}-{i}" for i, k in enumerate(self.kind.tolist())
+        ]
+
+        self.latitude = self.rng.uniform(-90.0, 90.0, n)
+        self.longitude = self.rng.uniform(-180.0, 180.0, n)
+        self.heart_rate = np.empty(n)
+        self.body_temperature = np.empty(n)
+        for k, (_, heart_rate_range, body_temperature_range, _) in enumerate(TRACKER_KINDS):
+            mask = self.kind == k
+            self.heart_rate[mask] = self.rng.uniform(*heart_rate_range, mask.sum())
+            self.body_temperature[mask] = self.rng.uniform(*body_temperature_range, mask.sum())
+        #NaN where the tracker type has no height or depth
+        altitude_kind = np.array([kind[3] for kind in TRACKER_KINDS])[self.kind]
+        self.height = np.where(altitude_kind == "height", self.rng.uniform(0, 9000, n), np.nan)
+        self.depth = np.where(altitude_kind == "depth", self.rng.uniform(0, 11000, n), np.nan)
+        self.message_order = np.zeros(n, dtype=np.int64)
+        #spread the first readings over one report interval
+        self.next_report = time.time() + self.rng.uniform(0, report_interval, n)
+
+        self.pool = ConnectionPool(max_idle_per_addr=connections)
+        self.outbox = queue.Queue(maxsize=max_pending)
+        self.stats_lock = threading.Lock()
+        self.readings_sent = 0
+        self.messages_sent = 0
+        self.readings_failed = 0
+        self.running = True
+
+        self.constellation = ConstellationView(
+            registration_server_host, registration_server_port, name="FleetSimulator", checksum=checksum
+        )
+
+    def __len__(self):
+        return len(self.kind)
+
+    def step(self, due):
+        #one collect_data step for the trackers in the index array due
+        m = len(due)
+        self.latitude[due] += self.rng.uniform(-0.001, 0.001, m)
+        self.longitude[due] += self.rng.uniform(-0.001, 0.001, m)
+        self.heart_rate[due] += self.rng.uniform(-0.5, 0.5, m)
+        self.body_temperature[due] += self.rng.uniform(-0.1, 0.1, m)
+
+        self.latitude[due] = np.clip(self.latitude[due], -90.0, 90.0)
+        self.longitude[due] = np.clip(self.longitude[due], -180.0, 180.0)
+        self.heart_rate[due] = np.clip(self.heart_rate[due], 20, 40)
+        self.body_temperature[due] = np.clip(self.body_temperature[due], 36.0, 39.0)
+
+        self.height[due] = np.clip(self.height[due] + self.rng.uniform(-5, 5, m), 0, 11000)
+        self.depth[due] = np.clip(self.depth[due] + self.rng.uniform(-1, 1, m), 0, 11000)
+        self.message_order[due] += 1
+
+    def altitudes(self, due):
+        #tracker altitude in km as used by closest_satellite: height up, depth down
+        h = np.zeros(len(due))
+        h = np.where(np.isnan(self.height[due]), h, self.height[due] / 1000)
+        h = np.where(np.isnan(self.depth[due]), h, -self.depth[due] / 1000)
+        return h
+
+    def closest_satellites(self, due, t, chunk=2_000_000):
+        #index of the closest satellite (3D distance) for every tracker in due
+        orbits = self.constellation.orbit_arrays()
+        sat_lat, sat_long = orbits.positions(t)
+        h = self.altitudes(due)
+        closest = np.empty(len(due), dtype=int)
+        rows = max(1, chunk // max(1, len(orbits)))
+        for lo in range(0, len(due), rows):
+            idx = due[lo:lo + rows]
+            d = haversine_np(self.latitude[idx, None], self.longitude[idx, None], sat_lat, sat_long)
+            d = np.sqrt(d ** 2 + (orbits.altitude - h[lo:lo + rows, None]) ** 2)
+            closest[lo:lo + rows] = np.argmin(d, axis=1)
+        return orbits, closest
+
+    def readings(self, due, now):
+        #collect_data dicts for the trackers in due
+        stamp = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+        columns = zip(
+            due.tolist(), self.message_order[due].tolist(), self.latitude[due].tolist(),
+            self.longitude[due].tolist(), self.heart_rate[due].tolist(),
+            self.body_temperature[due].tolist(), self.height[due].tolist(), self.depth[due].tolist(),
+        )
+        for i, order, lat, long, heart_rate, body_temperature, height, depth in columns:
+            data = {
+                "Message Order": order,
+                "datetime": stamp,
+                "device_name": self.names[i],
+                "latitude": lat,
+                "longitude": long,
+                "heart_rate": heart_rate,
+                "body_temperature": body_temperature,
+                "timestamp": now,
+                "source_ip": None,
+                "source_port": None,
+                "restored": False,
+            }
+            if not math.isnan(height):
+                data["height"] = height
+            if not math.isnan(depth):
+                data["depth"] = depth
+            yield data
+
+    def tick_once(self, now):
+        #advance every due tracker and queue its reading for the closest satellite
+        due = np.flatnonzero(self.next_report <= now)
+        if not len(due):
+            return 0
+        self.next_report[due] += self.report_interval
+        self.step(due)
+        orbits, closest = self.closest_satellites(due, now)
+
+        order = np.argsort(closest, kind="stable")
+        due, closest = due[order], closest[order]
+        bounds = np.flatnonzero(np.diff(closest)) + 1
+        readings = list(self.readings(due, now))
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(due)]):
+            satellite = orbits.satellites[closest[lo]]
+            for start in range(lo, hi, self.batch_size):
+                batch = readings[start:min(start + self.batch_size, hi)]
+                #waits when the senders fall behind
+                self.outbox.put((satellite, batch))
+        return len(due)
+
+    def sender(self):
+        while True:
+            satellite, batch = self.outbox.get()
+            addr = satellite["addr"]
+            try:
+                message = seal({"batch": batch}, SECRET_KEY, self.checksum)
+                message["hops"] = start_trace("FleetSimulator", time.time(), satellite["device_name"])
+                with self.pool.connection(addr) as sock:
+                    send_envelope(sock, message)
+                    if recv_text(sock) is None:
+                        raise ConnectionError("Satellite closed the connection before acknowledging")
+                with self.stats_lock:
+                    self.readings_sent += len(batch)
+                    self.messages_sent += 1
+            #a malformed ack or a reading that cannot be sealed is a ValueError
+            except (OSError, ValueError) as e:
+                with self.stats_lock:
+                    self.readings_failed += len(batch)
+                log.warning(f"[FleetSimulator] Failed to send {len(batch)} readings to {addr}: {e}")
+            finally:
+                #run() waits for every queued batch in outbox.join()
+                self.outbox.task_done()
+
+    def run(self, duration=None, stats_interval=10.0):
+        log.info(f"[FleetSimulator] Simulating {len(self)} trackers over {self.connections} connections")
+        self.constellation.start()
+        for _ in range(self.connections):
+            threading.Thread(target=self.sender, daemon=True).start()
+
+        start = time.time()
+        next_stats = start + stats_interval
+        last_sent = 0
+        try:
+            while self.running and (duration is None or time.time() - start < duration):
+                tick_start = time.time()
+                if self.constellation.satellites():
+                    self.tick_once(tick_start)
+                if tick_start >= next_stats:
+                    with self.stats_lock:
+                        sent, messages, failed = self.readings_sent, self.messages_sent, self.readings_failed
+                    log.info(
+                        f"[FleetSimulator] {(sent - last_sent) / stats_interval:.0f} readings/s, "
+                        f"{sent} readings in {messages} messages sent, {failed} failed, "
+                        f"outbox {self.outbox.qsize()}",
+                        extra={"fields": {"readings_sent": sent, "messages_sent": messages, "readings_failed": failed}},
+                    )
+                    last_sent = sent
+                    next_stats += stats_interval
+                time.sleep(max(0.0, tick_start + self.tick - time.time()))
+            self.outbox.join()
+        except KeyboardInterrupt:
+            log.info("[FleetSimulator] Stopping")
+        finally:
+            self.constellation.stop()
+            self.pool.close_all()
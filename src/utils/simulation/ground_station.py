@@ -1,50 +1,77 @@
 import socket
-import json
-import time
-import hashlib
 import threading
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
+import time
 from utils.encryption import SECRET_KEY
-
-import logging
-import os
-import datetime
-
-def write_log(message):
-
-    log_dir = "logs"
-    os.makedirs(log_dir, exist_ok=True)
-
-    log_file = os.path.join(log_dir, f"log_ground_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.txt")
-
-    logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s - %(message)s')
-
-    logging.info(message)
+from utils.crypto import open_sealed, ChecksumError
+from utils.protocol import recv_envelope, send_text, envelope_size
+from utils.telemetry_store import TelemetryStore
+from utils.clock import SYSTEM_CLOCK
+from utils.trace import HopStats, path_string, relays, GROUND_STATION
+from utils.sequence import DuplicateFilter, ReorderBuffer, DUPLICATE, LATE, RESTARTED
+from utils.log import get_logger
+from utils import metrics
+
+log = get_logger("ground_station")
+
+MESSAGES_IN = metrics.counter("ground_station_messages_in_total", "Envelopes received from satellites")
+BYTES_IN = metrics.counter("ground_station_bytes_in_total", "Envelope bytes received")
+READINGS = metrics.counter("ground_station_readings_total", "Readings decrypted and validated")
+DECRYPT_FAILURES = metrics.counter("ground_station_decrypt_failures_total", "Envelopes that failed to decrypt")
+CHECKSUM_FAILURES = metrics.counter("ground_station_checksum_failures_total", "Envelopes with a checksum mismatch")
+LATENCY = metrics.histogram("ground_station_latency_seconds", "End-to-end latency of a reading, tracker to ground station")
+HOPS = metrics.histogram("ground_station_hops", "Satellites a reading passed through", buckets=metrics.HOP_BUCKETS)
+DUPLICATES = metrics.counter("ground_station_duplicates_total", "Readings dropped as already received")
+LATE_READINGS = metrics.counter(
+    "ground_station_late_readings_total", "Readings older than the duplicate window, stored without a check"
+)
+TRACKED_DEVICES = metrics.gauge("ground_station_tracked_devices", "Devices with a duplicate window")
+REORDER_BUFFERED = metrics.gauge("ground_station_reorder_buffered", "Readings waiting for the ones before them")
+REORDER_SKIPPED = metrics.gauge("ground_station_reorder_skipped", "Missing readings the reorder buffer gave up on")
 
 class GroundStationReceiver:
-    def __init__(self, host, port):
+    def __init__(self, host, port, store_path="data/telemetry.db", clock=SYSTEM_CLOCK, hop_report_interval=60.0,
+                 dedup_window=1024, reorder_size=0, reorder_wait=10.0):
         self.host = host
         self.port = int(port)
-
-    def calculate_checksum(self, data):
-        json_data = json.dumps(data, sort_keys=True).encode('utf-8')
-        return hashlib.sha256(json_data).hexdigest()
-
-    def decrypt_data(self, iv, encrypted_data, tag , key):
-        cipher = Cipher(algorithms.AES(key), modes.GCM(iv, tag), backend=default_backend())
-        decryptor = cipher.decryptor()
-        decrypted_data = decryptor.update(encrypted_data) + decryptor.finalize()
-
-        return json.loads(decrypted_data.decode('utf-8'))
-
+        #receive times come from the wall clock or a simulation's virtual clock
+        self.clock = clock
+        #decrypted readings go to a batched SQLite sink, None only logs them
+        self.store = TelemetryStore(store_path) if store_path else None
+        #per satellite and per link latency from the hop records, logged every hop_report_interval seconds
+        self.hop_stats = HopStats(hop_report_interval)
+        #drop readings received before, by device and "Message Order", 0 turns it off
+        self.duplicates = DuplicateFilter(dedup_window) if dedup_window else None
+        #readings dropped as duplicates, logged on close for benchmarks/network.py
+        self.duplicates_dropped = 0
+        #store each device's readings in order, holding up to reorder_size per device, 0 turns it off
+        self.reorder = ReorderBuffer(self.emit, reorder_size, reorder_wait) if reorder_size else None
+        #process_message runs on several threads, both are only used under this lock
+        self.sequence_lock = threading.Lock()
+        if self.duplicates is not None:
+            TRACKED_DEVICES.set_function(lambda: len(self.duplicates))
+        if self.reorder is not None:
+            REORDER_BUFFERED.set_function(lambda: len(self.reorder))
+            REORDER_SKIPPED.set_function(lambda: self.reorder.skipped)
+
+    def start_reorder_expiry(self):
+        #release readings whose gap timed out even when their device sends nothing more
+        if self.reorder is not None:
+            threading.Thread(target=self.reorder_expiry, daemon=True).start()
+
+    def reorder_expiry(self):
+        interval = max(0.05, min(1.0, self.reorder.max_wait / 2))
+        while True:
+            time.sleep(interval)
+            with self.sequence_lock:
+                self.reorder.expire(self.clock.time())
 
     def listen_for_data(self):
         #Listen for data from Satellite and send acknowledgment.
+        self.start_reorder_expiry()
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.bind((self.host, self.port))
             s.listen()
-            print(f"[Ground Station] Listening on {self.host}:{self.port}")
+            log.info(f"[Ground Station] Listening on {self.host}:{self.port}")
 
             try:
                 while True:
@@ -52,62 +79,120 @@ class GroundStationReceiver:
                     threading.Thread(target=self.handle_tracker, args=(conn, addr)).start()                            
 
             except KeyboardInterrupt:
-                print("[Ground Station] Shutting down gracefully")
+                log.info("[Ground Station] Shutting down gracefully")
+                self.close_store()
+
+    def close_store(self):
+        self.hop_stats.report()
+        log.info(
+            "[Ground Station] Dropped %d duplicate readings", self.duplicates_dropped,
+            extra={"fields": {"duplicates_dropped": self.duplicates_dropped}},
+        )
+        if self.reorder is not None:
+            with self.sequence_lock:
+                self.reorder.flush()
+        if self.store is not None:
+            self.store.close()
 
     def handle_tracker(self, conn, addr):
         with conn:
-            print(f"[Ground Station] Connection established with {addr}")
-            while True:
-                data = conn.recv(4096)
-                if not data:
-                    print(f"[Ground Station] Connection closed by {addr}")
-                    break
-
-                # received_data = json.loads(data.decode('utf-8'))
-
-                message = json.loads(data.decode('utf-8'))
-                iv = bytes.fromhex(message["iv"])
-                encrypted_data = bytes.fromhex(message["encrypted_data"])
-                tag = bytes.fromhex(message["tag"])
-                path = message["path"] + "-->Ground Station\n"
-                print("\nMessage Travel Path: ", path)
-                write_log('\nMessage Travel Path: ' + str(path))
-                '''received_data = json.loads(data.decode('utf-8'))
-
-                ack_message = f"Data received from {received_data['device_name']} at {time.time()}"
-                print(f"\n\n[Ground Station] Received data from {received_data['device_name']}: {received_data}")
-                conn.sendall(ack_message.encode('utf-8'))
-                print(f"\n[Ground Station] Sent acknowledgment to Satellite")'''
-
-                try:
-                    #decrypt received data
-                    received_data = self.decrypt_data(iv, encrypted_data, tag, SECRET_KEY)
-                    final_time = time.time()
-                    initial_time = received_data['timestamp']
-                    #calculate latency
-                    print('\nTotal Time taken in message travel : ',final_time - initial_time)
-                    write_log('Total Time taken in message travel : ' + str(final_time - initial_time))
-                
-                    #remove shared checksum and recalculate
-                    received_checksum = received_data.pop("checksum", None)
-                    calculated_checksum = self.calculate_checksum(received_data)
-
-                    # Validating checksum
-                    if received_checksum == calculated_checksum:
-                        print(f"[Ground Station] Data received successfully with valid checksum: {received_checksum}")
-                        ack_message = f"Data received from Satellite at {final_time}"
-                        print(f"\n\n[Ground Station] Received data : {received_data}")
-                        write_log('Received Data : ' + str(received_data) + '\n')
-                    else:
-                        print(f"[Ground Station] Checksum mismatch! Received: {received_checksum}, Calculated: {calculated_checksum}")
-                        ack_message = "\nError: Checksum mismatch detected!"
-                        write_log('Checksum mismatch! Received: ' + str(received_checksum) +', Calculated: ' + str(calculated_checksum) + '\n')
-                    
+            log.info(f"[Ground Station] Connection established with {addr}")
+            try:
+                while True:
+                    message = recv_envelope(conn)
+                    if message is None:
+                        log.info(f"[Ground Station] Connection closed by {addr}")
+                        break
 
-                    # Send acknowledgment back to the tracker
-                    conn.sendall(ack_message.encode('utf-8'))
-                    print(f"\n[Ground Station] Sent acknowledgment to Satellite")
+                    ack_message = self.process_message(message)
 
-                except Exception as e:
-                    print(f"[Ground Station] Error in decryption/validation: {e}")
-                    conn.sendall(b"Error: Decryption failed")
+                    # Send acknowledgment back to the tracker
+                    send_text(conn, ack_message)
+                    log.debug("[Ground Station] Sent acknowledgment to Satellite")
+            except (OSError, ValueError) as e:
+                log.warning(f"[Ground Station] Connection error with {addr}: {e}")
+
+    def process_message(self, message):
+        #decrypt and validate one envelope, returns the acknowledgment to send back
+        path = path_string(message["hops"], GROUND_STATION)
+        MESSAGES_IN.inc()
+        BYTES_IN.inc(envelope_size(message))
+        log.debug("[Ground Station] Message Travel Path: %s", path)
+
+        try:
+            #decrypt and check the shared checksum, without one the GCM tag already authenticated the data
+            received_data = open_sealed(message, SECRET_KEY)
+            final_time = self.clock.time()
+            log.debug("[Ground Station] Data received successfully with a valid checksum")
+            ack_message = f"Data received from Satellite at {final_time}"
+            hops = relays(message["hops"])
+            #batched uplinks carry several readings in one message
+            records = [record for record in received_data.get("batch", [received_data]) if self.is_new(record)]
+            #a resent envelope would count its path twice, only time the ones that brought news
+            if records:
+                self.hop_stats.add(message["hops"], final_time)
+            for record in records:
+                #calculate latency
+                latency = final_time - record['timestamp']
+                READINGS.inc()
+                LATENCY.observe(latency)
+                HOPS.observe(hops)
+                log.info(
+                    "[Ground Station] Reading %s from %s via %s, total time taken in message travel: %.6f s",
+                    record.get("Message Order"), record.get("device_name"), path, latency,
+                    extra={"fields": {
+                        "device": record.get("device_name"), "path": path, "latency": latency, "hops": message["hops"],
+                    }},
+                )
+                self.release(record, path_string(message["hops"]), final_time)
+            self.hop_stats.maybe_report(final_time)
+            return ack_message
+
+        except ChecksumError:
+            log.warning("[Ground Station] Checksum mismatch!")
+            CHECKSUM_FAILURES.inc()
+            return "\nError: Checksum mismatch detected!"
+
+        except Exception as e:
+            DECRYPT_FAILURES.inc()
+            log.error(f"[Ground Station] Error in decryption/validation: {e}")
+            return "Error: Decryption failed"
+
+    def is_new(self, record):
+        #False for a reading received before, the ack still goes out so the sender stops resending
+        order = record.get("Message Order")
+        if self.duplicates is None or order is None:
+            return True
+        device = record.get("device_name")
+        with self.sequence_lock:
+            verdict = self.duplicates.check(device, order, record.get("timestamp"))
+            if verdict == RESTARTED and self.reorder is not None:
+                self.reorder.reset(device)
+            elif verdict == DUPLICATE:
+                self.duplicates_dropped += 1
+        if verdict == DUPLICATE:
+            DUPLICATES.inc()
+            log.debug("[Ground Station] Dropped duplicate reading %s from %s", order, device)
+            return False
+        if verdict == LATE:
+            LATE_READINGS.inc()
+        elif verdict == RESTARTED:
+            log.info(f"[Ground Station] {device} started counting again at reading {order}")
+        return True
+
+    def release(self, record, path, received_at):
+        #store the reading now, or once the readings before it are in when reordering
+        order = record.get("Message Order")
+        if self.reorder is None or order is None:
+            self.emit((record, path, received_at))
+            return
+        with self.sequence_lock:
+            self.reorder.push(record.get("device_name"), order, (record, path, received_at), self.clock.time())
+
+    def emit(self, item):
+        record, path, received_at = item
+        if self.store is not None:
+            self.store.add(record, path, received_at)
+            log.debug("[Ground Station] Received data : %s", record)
+        else:
+            log.info("[Ground Station] Received data : %s", record, extra={"fields": {"reading": record}})
@@ -1,36 +1,60 @@
-import os
 import json
-import hashlib
-import time
 import math
+import time
 import random
 import socket
 import threading
-import ast
 import signal
 import sys
 
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
-
-from utils.encryption import SECRET_KEY
+from utils.encryption import SECRET_KEY, USE_CHECKSUM
+from utils.crypto import seal
+from utils.protocol import FrameReader, split_envelope, send_envelope, send_text, recv_text, envelope_size, FRAME_HEADER
+from utils.connection_pool import ConnectionPool
+from utils.constellation import ConstellationView
+from utils.store_forward import StoreAndForwardBuffer
+from utils.routing import RoutingEngine
+from utils.contact_plan import ContactPlanner
+from utils.delay_scheduler import DelayScheduler
+from utils.clock import SYSTEM_CLOCK
+from utils.trace import arrive, depart, visited, path_string
+from utils.log import get_logger
+from utils import metrics
 from ip_config import ground_station_host, ground_station_port
 
+log = get_logger("satellite")
+
+MESSAGES_IN = metrics.counter("satellite_messages_in_total", "Envelopes received from trackers and satellites")
+BYTES_IN = metrics.counter("satellite_bytes_in_total", "Envelope bytes received")
+MESSAGES_OUT = metrics.counter("satellite_messages_out_total", "Envelopes handed over and acknowledged", ["next_hop"])
+BYTES_OUT = metrics.counter("satellite_bytes_out_total", "Envelope bytes handed over")
+FORWARD_ERRORS = metrics.counter("satellite_forward_errors_total", "Handovers that failed, the message was buffered")
+BUFFERED = metrics.gauge("satellite_buffered_messages", "Messages waiting in the store-and-forward buffer")
+IN_FLIGHT = metrics.gauge("satellite_in_flight_messages", "Messages waiting out their travel time")
+HOP_LATENCY = metrics.histogram(
+    "satellite_hop_latency_seconds", "From receiving a message to the acknowledgment of the next hop"
+)
+
 
 class SatelliteEmulator:
 
-    def __init__(self, device_name, host, port, ground_ip, ground_port):
+    def __init__(self, device_name, host, port, ground_ip, ground_port, vectorized=True,
+                 buffer_size=1000, buffer_dir=None, flush_interval=5.0, routing="table", clock=SYSTEM_CLOCK,
+                 senders=8, checksum=USE_CHECKSUM):
         self.device_name = device_name
         self.host = host
         self.port = int(port)
         self.ground_station_ip = ground_ip
         self.ground_station_port = int(ground_port)
         # self.gs = gs
+        #wall clock, or the virtual clock of a discrete-event simulation
+        self.clock = clock
+        #add a SHA-256 checksum to registry requests on top of the AES-GCM tag
+        self.checksum = checksum
 
         self.ground_lat = 53.3437967
         self.ground_long = -6.2571465
 
-        self.delay_message = 0.0
         # self.latitude = random.uniform(-90.0, 90.0)
         # self.longitude = random.uniform(-180.0, 180.0)
         # self.altitude = 700.0  # in KMs
@@ -43,39 +67,33 @@ class SatelliteEmulator:
             "inclination": random.uniform(0.0, 180.0),
             "direction": random.choice([-1, 1]),
             "period": 3600 * random.uniform(0.0, 24.0) / 100, # make it move faster
-            "start_time": time.time(),
+            "start_time": clock.time(),
             "altitude": 700.0
         }
 
-        self.running = True
-
-    def calculate_checksum(self, data):
-
-        json_data = json.dumps(data, sort_keys=True).encode("utf-8")
-        return hashlib.sha256(json_data).hexdigest()
+        self.pool = ConnectionPool()
+        #use the NumPy next hop search, closest_hop_scalar is kept as reference
+        self.vectorized = vectorized
+        #constellation size from which next hops are found with the spatial index
+        self.index_threshold = 512
+        #"table" follows the shortest path routing table, "greedy" always takes the closest node
+        self.routing_mode = routing
+        self.routing = None
+        self.contacts = None
+
+        #messages without a reachable next hop wait here until one shows up
+        self.buffer = StoreAndForwardBuffer(buffer_size, buffer_dir)
+        self.flush_interval = flush_interval
+        self.flush_requested = threading.Event()
+        #messages waiting out their travel time, sent by a few sender threads when due
+        self.in_flight = DelayScheduler(senders, name=f"{device_name}-in-flight", clock=clock)
+        BUFFERED.set_function(self.buffer.qsize)
+        IN_FLIGHT.set_function(lambda: len(self.in_flight))
 
-    def decrypt_data(self, iv, encrypted_data, tag, key):
-        cipher = Cipher(
-            algorithms.AES(key), modes.GCM(iv, tag), backend=default_backend()
-        )
-        decryptor = cipher.decryptor()
-        decrypted_data = decryptor.update(encrypted_data) + decryptor.finalize()
-
-        return json.loads(decrypted_data.decode("utf-8"))
-
-    def encrypt_data(self, data, key):
-        iv = os.urandom(12)
-        encryptor = Cipher(
-            algorithms.AES(key), modes.GCM(iv), backend=default_backend()
-        ).encryptor()
-
-        data_bytes = json.dumps(data).encode("utf-8")
+        self.running = True
 
-        ciphertext = encryptor.update(data_bytes) + encryptor.finalize()
-        return iv, encryptor.tag, ciphertext
-    
     def calculate_position(self, orbit):
-        current_time = time.time()
+        current_time = self.clock.time()
         earth_rotation_rate = 360 / 86400
         
         t = current_time - orbit["start_time"]
@@ -102,67 +120,143 @@ class SatelliteEmulator:
         
         return R * c
 
-    def handover_data(self, data):
-        satellite_positions = ast.literal_eval(self.get_satellites_list())
-        #satellite_positions = [sp for sp in satellite_positions if sp["addr"] != f"{self.host}:{self.port}"]
-        satellite_positions = [sp for sp in satellite_positions if sp["device_name"] not in data["path"].split("-->")]
-        satellite_positions.append({
+    def ground_station_position(self):
+        return {
             "device_name": 'GroundStation',
             "addr": f"{self.ground_station_ip}:{self.ground_station_port}",
             "orbit": {
                 "init_lat": self.ground_lat,
                 "init_long": self.ground_long
             }
-        })
+        }
+
+    def closest_hop(self, data):
+        #propagate the whole constellation at once and take the argmin distance
+        exclude = visited(data["hops"])
+        self_lat, self_long = self.calculate_position(self.orbit)
+        orbits = self.constellation.orbit_arrays()
+        if len(orbits) >= self.index_threshold:
+            #large constellations use the KD-tree instead of a linear scan
+            found = self.constellation.spatial_index().nearest(self_lat, self_long, self.clock.time(), exclude=exclude)
+            i, min_distance = found[0] if found else (None, float("inf"))
+        else:
+            i, min_distance = orbits.nearest(self_lat, self_long, self.clock.time(), exclude=exclude)
+
+        ground_distance = self.haversine(self_lat, self_long, self.ground_lat, self.ground_long)
+        if i is None or ground_distance < min_distance:
+            return self.ground_station_position(), ground_distance
+        return orbits.satellites[i], min_distance
+
+    def closest_hop_scalar(self, data):
+        #reference implementation, one calculate_position/haversine per candidate
+        exclude = visited(data["hops"])
+        satellite_positions = [sp for sp in self.constellation.satellites() if sp["device_name"] not in exclude]
+        satellite_positions.append(self.ground_station_position())
         min_distance = float('inf')
         closest_position = None
-        print("\n")
         for position in satellite_positions:
-            # position = json.loads(position)
-            distance = 0
             #get latest geoposition of the satellite 
             self_lat, self_long = self.calculate_position(self.orbit)
             if position["device_name"] == "GroundStation":
-                horizontal_distance = self.haversine(self_lat, self_long, self.ground_lat, self.ground_long)
-                distance = horizontal_distance
-                print(f"Distance to Ground Station : {distance}")
+                distance = self.haversine(self_lat, self_long, self.ground_lat, self.ground_long)
             else:
                 lat, long = self.calculate_position(position["orbit"])
-                horizontal_distance = self.haversine(self_lat, self_long, lat, long)
-                # vertical_distance = abs(self.altitude - altitude)
-                # distance = math.sqrt(horizontal_distance**2 + vertical_distance**2)
-                distance = horizontal_distance
-                print(f"Distance to ({lat},{long}) : {distance}")
+                distance = self.haversine(self_lat, self_long, lat, long)
 
-            
             if distance < min_distance:
                 min_distance = distance
                 closest_position = position
+
+        return closest_position, min_distance
+
+    def routed_hop(self, data):
+        #next hop from the routing table, None when there is no usable route or no table yet
+        if self.routing is None:
+            return None
+        route = self.routing.next_hop(f"{self.host}:{self.port}", self.clock.time())
+        if route is None:
+            return None
+        satellite, distance = route
+        if satellite is None:
+            return self.ground_station_position(), distance
+        #tables from different time slices can disagree, never go back to a visited node
+        if satellite["device_name"] in visited(data["hops"]):
+            return None
+        return satellite, distance
+
+    def next_hop(self, data):
+        route = self.routed_hop(data)
+        if route is not None:
+            return route
+        #outside the link graph, fall back to the closest node
+        if self.vectorized:
+            return self.closest_hop(data)
+        return self.closest_hop_scalar(data)
+
+    def plan_handover(self, data):
+        #next hop for data and the light travel time to it, recorded as this node's departure
+        closest_position, min_distance = self.next_hop(data)
+        depart(data["hops"], self.clock.time(), closest_position["device_name"], min_distance)
     
-        print(f"\nClosest Device: {closest_position['device_name']}")
-        print(f"Shortest distance: {min_distance:.2f} km")
+        log.info(
+            "[%s] Forwarding %s to %s (%.2f km)",
+            self.device_name, path_string(data["hops"]), closest_position["device_name"], min_distance,
+            extra={"fields": {"next_hop": closest_position["device_name"], "distance_km": min_distance}},
+        )
 
         #simulate delay based on distance
         speed_of_light = 299_792.458
         travel_time = min_distance / speed_of_light
-        self.delay_message = travel_time
-        
+        return closest_position, travel_time
+
+    def handover_data(self, data):
+        #deliver after the travel time in this thread, raises when the next hop is unreachable
+        closest_position, travel_time = self.plan_handover(data)
+        log.debug("[%s] Simulating Message Travel Delay for %.6f seconds", self.device_name, travel_time)
+        self.clock.sleep(travel_time)
+        self.send_to_hop(closest_position, data)
+
+    def schedule_handover(self, data):
+        #the message is in the air for the travel time without holding a thread
+        received = time.monotonic()
+        closest_position, travel_time = self.plan_handover(data)
+        #the payload is a view into the connection's read buffer, keep a copy while it waits
+        data = dict(data, payload=bytes(data["payload"]))
+        log.debug("[%s] Simulating Message Travel Delay for %.6f seconds", self.device_name, travel_time)
+        self.in_flight.call_later(travel_time, self.deliver, closest_position, data, received)
+
+    def deliver(self, closest_position, data, received):
+        #runs on the in-flight scheduler once the travel time has passed
+        try:
+            self.send_to_hop(closest_position, data)
+        except Exception as e:
+            log.debug("[%s] Handover to %s failed: %s", self.device_name, closest_position["device_name"], e)
+            self.store_message(data)
+            return
+        HOP_LATENCY.observe(time.monotonic() - received)
+        #the path works again, deliver what piled up meanwhile
+        if not self.buffer.empty():
+            self.request_flush()
+
+    def send_to_hop(self, closest_position, data):
+        self.forward_hop(closest_position, data)
+        if closest_position["device_name"] == 'GroundStation':
+            MESSAGES_OUT.labels("ground_station").inc()
+        else:
+            MESSAGES_OUT.labels("satellite").inc()
+        BYTES_OUT.inc(envelope_size(data))
+
+    def forward_hop(self, closest_position, data):
         if closest_position["device_name"] != 'GroundStation':
             
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as st:
-                h, p = closest_position["addr"].split(":")
-                #connect to closest satellite
-                st.connect((h, int(p)))
-                print(f"[{self.device_name}] Connected to {closest_position['device_name']} at {closest_position['addr']}")
-
-                print(f"\nSimulating Message Travel Delay for {self.delay_message:.6f} seconds")
-                time.sleep(self.delay_message)
-                
-                st.sendall(json.dumps(data).encode('utf-8'))
-                print(f"[{self.device_name}] Data forwarded to Satellite {closest_position['device_name']} at {closest_position['addr']}")
-                ack = st.recv(1024).decode('utf-8')
+            #reuse a pooled connection to closest satellite
+            with self.pool.connection(closest_position["addr"]) as st:
+                log.debug("[%s] Connected to %s at %s", self.device_name, closest_position["device_name"], closest_position["addr"])
+                send_envelope(st, data)
+                log.debug("[%s] Data forwarded to Satellite %s at %s", self.device_name, closest_position["device_name"], closest_position["addr"])
+                ack = recv_text(st)
                 if ack:
-                    print(f"\n[{self.device_name}] Received acknowledgment from Satellite: {ack}")
+                    log.debug("[%s] Received acknowledgment from Satellite: %s", self.device_name, ack)
         elif closest_position["device_name"] == 'GroundStation':
             self.forward_to_ground_station(data)
             
@@ -176,17 +270,12 @@ class SatelliteEmulator:
 
     def forward_to_ground_station(self, data):
         
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as gs:
-            gs.connect((ground_station_host, int(ground_station_port)))
-
-            print(f"\nSimulating Message Travel Delay for {self.delay_message:.6f} seconds")
-            time.sleep(self.delay_message)
-            
-            gs.sendall(json.dumps(data).encode("utf-8"))
-            print(f"[{self.device_name}] Data forwarded to  ground station.")
-            ack = gs.recv(1024).decode("utf-8")
+        with self.pool.connection(f"{ground_station_host}:{ground_station_port}") as gs:
+            send_envelope(gs, data)
+            log.debug("[%s] Data forwarded to ground station.", self.device_name)
+            ack = recv_text(gs)
             if ack:
-                print(f"\n[{self.device_name}] Received acknowledgment from Ground Station: {ack}")
+                log.debug("[%s] Received acknowledgment from Ground Station: %s", self.device_name, ack)
 
     def register_to_network(self, network_host, network_port):
         #register satellite to the network
@@ -200,44 +289,99 @@ class SatelliteEmulator:
                     "orbit": self.orbit
                 })
             }
-            checksum = self.calculate_checksum(data)
-            data["checksum"] = checksum
-            iv, tag, encrypted_data = self.encrypt_data(
-                data, SECRET_KEY
-            )
-            message = {
-                "iv": iv.hex(),
-                "encrypted_data": encrypted_data.hex(),
-                "tag": tag.hex(),
-            }
-            final_message = json.dumps(message)
-            sock.sendall(final_message.encode("utf-8"))
-            ack = sock.recv(1024).decode("utf-8")
+            send_envelope(sock, seal(data, SECRET_KEY, self.checksum))
+            ack = recv_text(sock)
             if ack:
-                print(f"\n[{self.device_name}] Received acknowledgment: {ack}")
+                log.info(f"[{self.device_name}] Received acknowledgment: {ack}")
                 self.network_host = network_host
                 self.network_port = network_port
 
+        constellation = ConstellationView(network_host, network_port, name=self.device_name, checksum=self.checksum)
+        self.attach_constellation(constellation)
+        constellation.start()
+
+    def attach_constellation(self, constellation, routing=None, contacts=None):
+        #follow a satellite list, a simulation can share one routing engine and contact planner
+        self.constellation = constellation
+        self.constellation.add_listener(self.on_constellation_change)
+        if self.routing_mode == "table":
+            self.routing = routing or RoutingEngine(constellation, self.ground_lat, self.ground_long, clock=self.clock)
+        self.contacts = contacts or ContactPlanner(constellation, self.ground_lat, self.ground_long, clock=self.clock)
+
+    def on_constellation_change(self, event, satellite):
+        #close pooled connections to satellites that have deregistered
+        if event == "deregister":
+            self.pool.evict(satellite["addr"])
+        #a new satellite may be the missing next hop
+        elif not self.buffer.empty():
+            self.request_flush()
+
+    def next_ground_contact(self, t):
+        #(start, end, closest km) of the current or next pass over the ground station
+        plan = self.contacts.plan(t) if self.contacts is not None else None
+        if plan is None:
+            return None
+        return plan.next_contact(f"{self.host}:{self.port}", t)
+
+    def store_message(self, message):
+        FORWARD_ERRORS.inc()
+        self.buffer.put(message)
+        log.warning(f"[{self.device_name}] No next hop reachable, message stored ({self.buffer.qsize()} buffered)")
+        now = self.clock.time()
+        contact = self.next_ground_contact(now)
+        if contact is not None and contact[0] > now:
+            log.info(f"[{self.device_name}] Next ground station pass in {contact[0] - now:.0f} seconds")
+
+    def flush_wait(self):
+        #seconds until the next flush attempt, woken early for the next ground station pass
+        if self.buffer.empty():
+            return self.flush_interval
+        now = self.clock.time()
+        contact = self.next_ground_contact(now)
+        if contact is not None and now < contact[0] < now + self.flush_interval:
+            return contact[0] - now
+        return self.flush_interval
+
+    def request_flush(self):
+        self.flush_requested.set()
+
+    def flush_buffer(self):
+        #hand over buffered messages oldest first, stop at the first failure
+        try:
+            sent = self.buffer.flush(self.handover_data)
+        except Exception as e:
+            log.warning(f"[{self.device_name}] Next hop still unreachable, {self.buffer.qsize()} messages buffered: {e}")
+            return
+        if sent:
+            log.info(f"[{self.device_name}] Flushed {sent} buffered messages")
+
+    def flush_buffer_loop(self):
+        while self.running:
+            self.flush_requested.wait(self.flush_wait())
+            self.flush_requested.clear()
+            if not self.buffer.empty():
+                self.flush_buffer()
+
     def deregister_from_network(self):
+        #messages still in the air go to the buffer, which spills them to --buffer-dir on close
+        pending = self.in_flight.stop()
+        for _, (closest_position, data, received) in pending:
+            self.buffer.put(data)
+        if pending:
+            log.info(f"[{self.device_name}] Buffered {len(pending)} messages still in flight")
+        self.constellation.stop()
+        if self.routing is not None:
+            self.routing.stop()
+        self.pool.close_all()
+        self.buffer.close()
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             sock.connect((self.network_host, int(self.network_port)))
             data = {"content": f"deregister {self.host}:{self.port}"}
-            checksum = self.calculate_checksum(data)
-            data["checksum"] = checksum
-            iv, tag, encrypted_data = self.encrypt_data(
-                data, SECRET_KEY
-            )
-            message = {
-                "iv": iv.hex(),
-                "encrypted_data": encrypted_data.hex(),
-                "tag": tag.hex(),
-            }
-            final_message = json.dumps(message)
-            sock.sendall(final_message.encode("utf-8"))
-            ack = sock.recv(1024).decode("utf-8")
+            send_envelope(sock, seal(data, SECRET_KEY, self.checksum))
+            ack = recv_text(sock)
             if ack:
-                print(f"\n[{self.device_name}] Received acknowledgment: {ack}")
-                print(
+                log.info(f"[{self.device_name}] Received acknowledgment: {ack}")
+                log.info(
                     f"[{self.device_name}] {self.device_name} {self.host}:{self.port} Deregistered from network at {self.network_host}:{self.network_port}"
                 )
 
@@ -246,21 +390,9 @@ class SatelliteEmulator:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             sock.connect((self.network_host, int(self.network_port)))
             data = {"content": "get_list"}
-            checksum = self.calculate_checksum(data)
-            data["checksum"] = checksum
-            iv, tag, encrypted_data = self.encrypt_data(
-                data, SECRET_KEY
-            )
-            message = {
-                "iv": iv.hex(),
-                "encrypted_data": encrypted_data.hex(),
-                "tag": tag.hex(),
-            }
-            final_message = json.dumps(message)
-            sock.sendall(final_message.encode("utf-8"))
-            res = sock.recv(4096)
-            res = res.decode('utf-8')
-            print(f"\n[{self.device_name}] Received list of satellites:\n{res}")
+            send_envelope(sock, seal(data, SECRET_KEY, self.checksum))
+            res = json.loads(recv_text(sock))
+            log.info(f"[{self.device_name}] Received list of {len(res['satellites'])} satellites (version {res['version']})")
             return res
 
     # Listen for data from trackers
@@ -270,7 +402,8 @@ class SatelliteEmulator:
             # s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             s.bind((self.host, self.port))
             s.listen()
-            print(f"[{self.device_name}] Listening on {self.host}:{self.port}")
+            log.info(f"[{self.device_name}] Listening on {self.host}:{self.port}")
+            threading.Thread(target=self.flush_buffer_loop, daemon=True).start()
 
             try: 
 
@@ -283,37 +416,45 @@ class SatelliteEmulator:
 
             except KeyboardInterrupt:
                 self.deregister_from_network()
-                print("[Satellite] Shutting down gracefully")
+                log.info("[Satellite] Shutting down gracefully")
 
     def handle_tracker(self, conn, addr):
 
         with conn:
-            print(f"[{self.device_name}] Connection established with {addr}")
-            while True:
-                data = conn.recv(2048)
-                if not data:
-                    print(f"[{self.device_name}] Connection closed by {addr}")
-                    break
-
-                message = json.loads(data.decode("utf-8"))
-                print(f"\n\n[{self.device_name}] Received data")
-                message["path"] += "-->" + self.device_name
-
-                print("\nMessage Travel Path: ", message["path"])
-
-                try:
-                    self.handover_data(message)
-                except Exception as e:
-                    print(f"Using ML model...")
-                    
-                ack_message = f"Data received and forwarded at {time.time()}"
-                conn.sendall(ack_message.encode('utf-8'))
-                print(f"\n[{self.device_name}] Forwarded Message and Sent acknowledgment back")
+            log.info(f"[{self.device_name}] Connection established with {addr}")
+            reader = FrameReader(conn)
+            try:
+                while True:
+                    body = reader.read()
+                    if body is None:
+                        log.info(f"[{self.device_name}] Connection closed by {addr}")
+                        break
+
+                    MESSAGES_IN.inc()
+                    BYTES_IN.inc(FRAME_HEADER.size + len(body))
+
+                    #relays never decrypt, the payload stays a view into the read buffer
+                    message = split_envelope(body)
+
+                    arrive(message["hops"], self.device_name, self.clock.time())
+                    log.debug("[%s] Received data, Message Travel Path: %s", self.device_name, path_string(message["hops"]))
+
+                    try:
+                        self.schedule_handover(message)
+                        ack_message = f"Data received and forwarded at {self.clock.time()}"
+                    except Exception:
+                        self.store_message(message)
+                        ack_message = f"Data received and stored for forwarding at {self.clock.time()}"
+
+                    send_text(conn, ack_message)
+                    log.debug("[%s] Sent acknowledgment back", self.device_name)
+            except (OSError, ValueError) as e:
+                log.warning(f"[{self.device_name}] Connection error with {addr}: {e}")
                 
     
 
     def handle_sigterm(self, signal_number, frame):
-        print("[Satellite] Shutting down gracefully")
+        log.info("[Satellite] Shutting down gracefully")
         self.deregister_from_network()
         sys.exit(0)
 
@@ -1,50 +1,149 @@
-import os
-import logging
 import json
+import queue
+import uuid
 import socket
 import threading
-import hashlib
+from collections import deque
 from datetime import datetime
 
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
-
 from utils.encryption import SECRET_KEY
+from utils.crypto import open_sealed
+from utils.protocol import recv_envelope, send_text
+from utils.log import get_logger
+from utils import metrics
+
+log = get_logger("network")
+
+REQUESTS = metrics.counter("registry_requests_total", "Registry requests by command", ["command"])
+REQUEST_ERRORS = metrics.counter("registry_request_errors_total", "Requests that failed to decrypt or validate")
+SATELLITES = metrics.gauge("registry_satellites", "Registered satellites")
+SUBSCRIBERS = metrics.gauge("registry_subscribers", "Connections subscribed to satellite list updates")
+
+
+def parse_version(argument):
+    #"<version> <epoch>" of a client that has applied changes before, (None, None) for a new one
+    version, _, epoch = argument.partition(" ")
+    return (int(version) if version else None), (epoch or None)
 
 
-def write_log(message):
-    #storing logs for the network
-    log_dir = "logs"
-    os.makedirs(log_dir, exist_ok=True)
+class Subscriber:
+    # One subscribed connection. Events go through a bounded queue to a
+    # writer thread of its own, so a subscriber that stops reading never
+    # blocks the registry. When its queue is full it is disconnected, and it
+    # catches up with a delta when it subscribes again.
 
-    log_file = os.path.join(log_dir, f"log_network_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.txt")
+    def __init__(self, conn, addr, max_pending=1024):
+        self.conn = conn
+        self.addr = addr
+        self.queue = queue.Queue(max_pending)
+        self.closed = False
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def send(self, payload):
+        #queue payload for the writer, False when the subscriber fell too far behind
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except queue.Full:
+            self.close()
+            return False
+
+    def run(self):
+        while True:
+            payload = self.queue.get()
+            if payload is None or self.closed:
+                return
+            try:
+                send_text(self.conn, payload)
+            except OSError:
+                self.close()
+                return
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        #also ends the request loop reading this connection
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
 
-    logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s - %(message)s')
 
-    logging.info(message)
-    
 class SatelliteNetwork:
 
     def __init__(self, registration_host, registration_port):
-        self.satellites = []  
+        #registered satellites keyed by addr, every change bumps the version
+        self.satellites = {}
+        self.version = 0
+        #versions only mean something within one run of the registry, clients send both back
+        self.epoch = uuid.uuid4().hex[:16]
+        self.changes = deque(maxlen=1024)
         self.current_satellite_index = 0
 
+        #connections that receive register/deregister events, each with its own writer
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
         self.registration_host = registration_host
         self.registration_port = int(registration_port)
         self.registration_server_running = True
+        SATELLITES.set_function(lambda: len(self.satellites))
+        SUBSCRIBERS.set_function(lambda: len(self.subscribers))
         
-    def calculate_checksum(self, data):
-        """Calculate SHA-256 checksum of the JSON-encoded data."""
-        json_data = json.dumps(data, sort_keys=True).encode('utf-8')
-        return hashlib.sha256(json_data).hexdigest()
+    def register(self, satellite_info):
+        with self.lock:
+            if satellite_info["addr"] in self.satellites:
+                return False
+            self.satellites[satellite_info["addr"]] = satellite_info
+            self.record({"event": "register", "satellite": satellite_info})
+            return True
 
-    def decrypt_data(self, iv, encrypted_data, tag , key):
-        cipher = Cipher(algorithms.AES(key), modes.GCM(iv, tag), backend=default_backend())
-        decryptor = cipher.decryptor()
-        decrypted_data = decryptor.update(encrypted_data) + decryptor.finalize()
+    def deregister(self, addr):
+        with self.lock:
+            if self.satellites.pop(addr, None) is None:
+                return False
+            self.record({"event": "deregister", "addr": addr})
+            return True
 
-        
-        return json.loads(decrypted_data.decode('utf-8'))
+    def record(self, event):
+        #caller holds self.lock
+        self.version += 1
+        event["version"] = self.version
+        self.changes.append(event)
+        self.publish(event)
+
+    def snapshot(self):
+        #caller holds self.lock
+        return {
+            "event": "snapshot", "epoch": self.epoch, "version": self.version,
+            "satellites": list(self.satellites.values()),
+        }
+
+    def changes_since(self, version, epoch=None):
+        #only the changes a client at version is missing, or a snapshot if they are no longer kept
+        #or the version comes from an earlier run of the registry; caller holds self.lock
+        if version is None or epoch != self.epoch or version > self.version:
+            return self.snapshot()
+        missing = self.version - version
+        if missing > len(self.changes):
+            return self.snapshot()
+        changes = list(self.changes)[len(self.changes) - missing:] if missing else []
+        return {"event": "delta", "epoch": self.epoch, "version": self.version, "changes": changes}
+
+    def publish(self, event):
+        #queue an event for every subscribed connection without waiting for any, caller holds self.lock
+        payload = json.dumps(event)
+        for conn, subscriber in list(self.subscribers.items()):
+            if not subscriber.send(payload):
+                del self.subscribers[conn]
+                log.warning(f"[Network] Dropped subscriber {subscriber.addr}, it stopped reading updates")
 
     def registration_server(self):
         
@@ -52,8 +151,7 @@ class SatelliteNetwork:
             server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             server_socket.bind((self.registration_host, self.registration_port))
             server_socket.listen()
-            print(f"[Network] Registration server listening on {self.registration_host}:{self.registration_port}")
-            write_log(f"[Network] Registration server listening on {self.registration_host}:{self.registration_port}")
+            log.info(f"[Network] Registration server listening on {self.registration_host}:{self.registration_port}")
 
             while self.registration_server_running:
                 conn, addr = server_socket.accept()
@@ -67,62 +165,73 @@ class SatelliteNetwork:
         #Handle incoming registration requests from satellites
         with conn:
 
-            while True:
-                data = conn.recv(2048).decode('utf-8')
-                if not data:
-                    break
-
-                message = json.loads(data)
-                iv = bytes.fromhex(message["iv"])
-                encrypted_data = bytes.fromhex(message["encrypted_data"])
-                tag = bytes.fromhex(message["tag"])
-                
-                try:
-                    received_data = self.decrypt_data(iv, encrypted_data, tag, SECRET_KEY)
-                    received_checksum = received_data.pop("checksum", None)
-                    calculated_checksum = self.calculate_checksum(received_data)
-
-                    # Validate checksum
-                    if received_checksum != calculated_checksum:
-                        raise Exception
-                    
-                    data_content = received_data["content"]
-
-                    if data_content.startswith("register"):
-                        satellite_info = json.loads(data_content.split("register ")[1])
-                        if not any(s.get("addr") == satellite_info.get("addr") for s in self.satellites):
-                            self.satellites.append(satellite_info)
-                            ack_message = f'Satellite registered at {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}'
-                            conn.sendall(ack_message.encode("utf-8"))
-                            print(f"[Network] Registered satellite: {satellite_info}")
-                            write_log(f"[Network] Registered satellite: {satellite_info}")
-                        else:
-                            ack_message = f"Satellite already registered"
-                            conn.sendall(ack_message.encode("utf-8"))
-                            print(f"[Network] Already registered satellite: {satellite_info}")
-                            write_log(f"[Network] Already registered satellite: {satellite_info}")
-                    elif data_content.startswith("deregister"):
-                        satellite_info = data_content.split("deregister ")[1]
-                        if any(satellite['addr'] == satellite_info for satellite in self.satellites):
-                            self.satellites = [satellite for satellite in self.satellites if satellite['addr'] != satellite_info]
-                            ack_message = f'Satellite deregistered at {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}'
-                            conn.sendall(ack_message.encode("utf-8"))
-                            print(f"[Network] Deregistered satellite: {satellite_info}")
-                            write_log(f"[Network] Deregistered satellite: {satellite_info}")
-                    elif data_content == "get_list":
-                        list_of_satellites = "".join(self.satellites.__str__())
-                        conn.sendall(list_of_satellites.encode('utf-8'))
-                        print("[Network] Sent list of satellites")
-                        write_log("[Network] Sent list of satellites")
+            try:
+                self.handle_requests(conn, addr)
+            except (OSError, ValueError) as e:
+                log.warning(f"[Network] Connection error with {addr}: {e}")
+            finally:
+                with self.lock:
+                    subscriber = self.subscribers.pop(conn, None)
+                if subscriber is not None:
+                    subscriber.close()
+
+    def handle_requests(self, conn, addr):
+
+        while True:
+            message = recv_envelope(conn)
+            if message is None:
+                break
+
+            try:
+                #decrypt and validate checksum
+                received_data = open_sealed(message, SECRET_KEY)
+
+                data_content = received_data["content"]
+
+                command, _, argument = data_content.partition(" ")
+                REQUESTS.labels(command if command in ("register", "deregister", "subscribe", "get_list") else "other").inc()
+
+                if command == "register":
+                    satellite_info = json.loads(argument)
+                    if self.register(satellite_info):
+                        ack_message = f'Satellite registered at {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}'
+                        send_text(conn, ack_message)
+                        log.info(f"[Network] Registered satellite: {satellite_info}")
+                    else:
+                        ack_message = f"Satellite already registered"
+                        send_text(conn, ack_message)
+                        log.info(f"[Network] Already registered satellite: {satellite_info}")
+                elif command == "deregister":
+                    if self.deregister(argument):
+                        ack_message = f'Satellite deregistered at {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}'
+                        log.info(f"[Network] Deregistered satellite: {argument}")
                     else:
-                        ack_message = f'Incorrect command'
-                        conn.sendall(ack_message.encode("utf-8"))
-                        print(f"[Network] Incorrect command")
-                        write_log("[Network] Incorrect command")
-                except Exception as e:
-                    print(f"[Network] Error in decryption/validation: {e}")
-                    write_log(f"[Network] Error in decryption/validation: {e}")
-                    conn.sendall(b"Error: Decryption failed")
+                        ack_message = f"Satellite not registered"
+                    send_text(conn, ack_message)
+                elif command == "subscribe":
+                    #reply with what the client is missing, then push every change
+                    version, epoch = parse_version(argument)
+                    with self.lock:
+                        #the writer sends the reply before any event published after it
+                        subscriber = Subscriber(conn, addr)
+                        subscriber.send(json.dumps(self.changes_since(version, epoch)))
+                        self.subscribers[conn] = subscriber
+                    log.info(f"[Network] Subscribed {addr} to satellite list updates")
+                elif command == "get_list":
+                    #"get_list <version> <epoch>" only returns the changes after version
+                    version, epoch = parse_version(argument)
+                    with self.lock:
+                        response = self.changes_since(version, epoch)
+                    send_text(conn, json.dumps(response))
+                    log.debug("[Network] Sent list of satellites")
+                else:
+                    ack_message = f'Incorrect command'
+                    send_text(conn, ack_message)
+                    log.warning("[Network] Incorrect command")
+            except Exception as e:
+                REQUEST_ERRORS.inc()
+                log.error(f"[Network] Error in decryption/validation: {e}")
+                send_text(conn, "Error: Decryption failed")
 
     # def perform_handover(self):
     #     # Handover to the next satellite in network
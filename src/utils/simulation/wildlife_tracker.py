@@ -1,21 +1,38 @@
 import os
 import random
 import json
-import hashlib
 import time
 import socket
 import threading
 import queue
 import math
-import ast
+import logging
 from datetime import datetime
 
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
-
-from utils.encryption import SECRET_KEY
+from utils.encryption import SECRET_KEY, USE_CHECKSUM
+from utils.crypto import seal
+from utils.protocol import send_envelope, recv_text, envelope_size
+from utils.constellation import ConstellationView
+from utils.persistent_queue import PersistentQueue
+from utils.clock import SYSTEM_CLOCK
+from utils.trace import start_trace
+from utils.log import get_logger
+from utils import metrics
 from ip_config import registration_server_host, registration_server_port
 
+log = get_logger("tracker")
+
+READINGS_COLLECTED = metrics.counter("tracker_readings_collected_total", "Readings collected")
+READINGS_SENT = metrics.counter("tracker_readings_sent_total", "Readings acknowledged by a satellite")
+MESSAGES_SENT = metrics.counter("tracker_messages_sent_total", "Uplink envelopes acknowledged by a satellite")
+BYTES_SENT = metrics.counter("tracker_bytes_sent_total", "Uplink envelope bytes sent")
+SEND_ERRORS = metrics.counter("tracker_send_errors_total", "Connection errors while sending to a satellite")
+QUEUE_SIZE = metrics.gauge("tracker_message_queue_size", "Readings waiting in the message queue")
+
+#seconds between attempts to reach a satellite, doubled after each failure
+RETRY_MIN = 1
+RETRY_MAX = 60
+
 
 class WildLifeTracker:
 
@@ -26,8 +43,20 @@ class WildLifeTracker:
         source_port,
         heart_rate_range,
         body_temperature_range,
+        batch_size=1,
+        batch_interval=0,
+        queue_dir=None,
+        queue_max_items=10000,
+        queue_overflow="drop_oldest",
+        clock=SYSTEM_CLOCK,
+        constellation=None,
+        checksum=USE_CHECKSUM,
     ):
         self.device_name = device_name
+        #wall clock, or the virtual clock of a discrete-event simulation
+        self.clock = clock
+        #add a SHA-256 checksum to every uplink on top of the AES-GCM tag
+        self.checksum = checksum
         
         self.latitude = random.uniform(-90.0, 90.0)
         self.longitude = random.uniform(-180.0, 180.0)
@@ -35,34 +64,54 @@ class WildLifeTracker:
         self.heart_rate = random.uniform(*heart_rate_range)
         self.body_temperature = random.uniform(*body_temperature_range)
 
-        self.message_queue = queue.Queue()
-        
         self.source_ip = source_ip
         self.source_port = source_port
         self.message_order = 0
+        #file keeping the last message order, the queue log is compacted away once acknowledged
+        self.message_order_path = None
+
+        if queue_dir is None:
+            self.message_queue = queue.Queue()
+        else:
+            #readings survive restarts, so the tracker keeps its name and message order too
+            self.message_queue = PersistentQueue(queue_dir, queue_max_items, queue_overflow)
+            name_path = os.path.join(queue_dir, "device_name")
+            if os.path.exists(name_path):
+                with open(name_path) as f:
+                    self.device_name = f.read().strip()
+            else:
+                with open(name_path, "w") as f:
+                    f.write(self.device_name)
+            self.message_order_path = os.path.join(queue_dir, "message_order")
+            if os.path.exists(self.message_order_path):
+                with open(self.message_order_path) as f:
+                    self.message_order = int(f.read().strip() or 0)
+            #directories written before the file existed only have the log
+            if self.message_queue.last_item is not None:
+                self.message_order = max(self.message_order, self.message_queue.last_item["Message Order"])
+            restored = self.message_queue.qsize()
+            if restored:
+                log.info(f"[{self.device_name}] Restored {restored} unsent readings from {queue_dir}")
+        QUEUE_SIZE.set_function(self.message_queue.qsize)
         self.delay_message = 0.0
+        self.satellite_distance = None
+        #readings per uplink frame and how long (ms) to wait to fill a batch
+        self.batch_size = max(1, int(batch_size))
+        self.batch_interval = batch_interval
+        #use the NumPy satellite search, closest_satellite_scalar is kept as reference
+        self.vectorized = True
+        #constellation size from which the spatial index is used
+        self.index_threshold = 512
 
         
-        # Get satellite list
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect((registration_server_host, int(registration_server_port)))
-            data = {"content": "get_list"}
-            checksum = self.calculate_checksum(data)
-            data["checksum"] = checksum
-            iv, tag, encrypted_data = self.encrypt_data(
-                data, SECRET_KEY
+        # Keep a cached satellite list that the registration server pushes updates to
+        if constellation is None:
+            constellation = ConstellationView(
+                registration_server_host, registration_server_port, name=self.device_name, checksum=checksum
             )
-            message = {
-                "iv": iv.hex(),
-                "encrypted_data": encrypted_data.hex(),
-                "tag": tag.hex(),
-            }
-            final_message = json.dumps(message)
-            sock.sendall(final_message.encode("utf-8"))
-            res = sock.recv(4096)
-            res = res.decode('utf-8')
-            #print(f"\n[{self.device_name}] Received list of satellites:\n{res}")
-            self.satellite_list = ast.literal_eval(res)
+            constellation.start()
+        self.constellation = constellation
+        self.satellite_list = self.constellation.satellites()
 
     def collect_data(self):
         # Simulate changes
@@ -77,12 +126,16 @@ class WildLifeTracker:
         self.heart_rate = max(20, min(40, self.heart_rate))
         self.body_temperature = max(36.0, min(39.0, self.body_temperature))
         self.message_order += 1
+        #saved before the reading is queued, so a restart never reuses a number
+        if self.message_order_path is not None:
+            self.save_message_order()
+        READINGS_COLLECTED.inc()
 
-        timestamp = time.time()
+        timestamp = self.clock.time()
 
         data = {
             "Message Order": self.message_order,
-            "datetime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "datetime": datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"),
             "device_name": self.device_name,
             "latitude": self.latitude,
             "longitude": self.longitude,
@@ -97,47 +150,17 @@ class WildLifeTracker:
 
         return data
 
-    def calculate_checksum(self, data):
-        
-        json_data = json.dumps(data, sort_keys=True).encode("utf-8")
-        return hashlib.sha256(json_data).hexdigest()
-
-    def encrypt_data(self, data, key):
-        iv = os.urandom(12)  
-        encryptor = Cipher(
-            algorithms.AES(key), modes.GCM(iv), backend=default_backend()
-        ).encryptor()
-
-        data_bytes = json.dumps(data).encode("utf-8")
-
-        ciphertext = encryptor.update(data_bytes) + encryptor.finalize()
-        # print('result of encrypt_data :',iv + encryptor.tag + ciphertext)
-        return iv, encryptor.tag, ciphertext
+    def save_message_order(self):
+        tmp_path = self.message_order_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self.message_order))
+        os.replace(tmp_path, self.message_order_path)
 
     def get_satellite_list(self):
-        
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect((registration_server_host, int(registration_server_port)))
-            data = {"content": "get_list"}
-            checksum = self.calculate_checksum(data)
-            data["checksum"] = checksum
-            iv, tag, encrypted_data = self.encrypt_data(
-                data, SECRET_KEY
-            )
-            message = {
-                "iv": iv.hex(),
-                "encrypted_data": encrypted_data.hex(),
-                "tag": tag.hex(),
-            }
-            final_message = json.dumps(message)
-            sock.sendall(final_message.encode("utf-8"))
-            res = sock.recv(4096)
-            res = res.decode('utf-8')
-            print(f"\n[{self.device_name}] Received list of satellites:\n{res}")
-            self.satellite_list = ast.literal_eval(res)
+        self.satellite_list = self.constellation.satellites()
 
     def calculate_position(self, orbit):
-        current_time = time.time()
+        current_time = self.clock.time()
         earth_rotation_rate = 360 / 86400
         
         t = current_time - orbit["start_time"]
@@ -154,34 +177,53 @@ class WildLifeTracker:
 
         return lat, long
     
-    def closest_satellite(self):
+    def closest_satellite_scalar(self, h):
+        #reference implementation, one calculate_position/haversine_3d per satellite
         closest_satellite = None
         min_distance = float('inf')
-        
-        h = None
-        if self.height is not None:
-            h = self.height / 1000
-        elif self.depth is not None:
-            h = -self.depth / 1000
-        else:
-            h = 0
 
         self.get_satellite_list()
-        print('\n')
         for satellite in self.satellite_list:
             satellite_lat, satellite_lon = self.calculate_position(satellite["orbit"])
             distance = self.haversine_3d(self.latitude, self.longitude, h, satellite_lat, satellite_lon, satellite["orbit"]["altitude"])
-            print(f"Distance to satellite at ({satellite_lat}, {satellite_lon}): {distance:.2f} km")
 
             if distance < min_distance:
                 min_distance = distance
                 closest_satellite = satellite
 
-        print(f"Closest satellite is at ({closest_satellite['device_name']}, {closest_satellite['addr']})")
+        return closest_satellite, min_distance
+
+    def closest_satellite(self):
+        h = None
+        if self.height is not None:
+            h = self.height / 1000
+        elif self.depth is not None:
+            h = -self.depth / 1000
+        else:
+            h = 0
+
+        if self.vectorized:
+            #propagate the whole constellation at once and take the argmin distance
+            orbits = self.constellation.orbit_arrays()
+            if len(orbits) >= self.index_threshold:
+                #large constellations use the KD-tree instead of a linear scan
+                found = self.constellation.spatial_index().nearest(self.latitude, self.longitude, self.clock.time(), h=h)
+                i, min_distance = found[0] if found else (None, float("inf"))
+            else:
+                i, min_distance = orbits.nearest(self.latitude, self.longitude, self.clock.time(), h=h)
+            closest_satellite = orbits.satellites[i] if i is not None else None
+        else:
+            closest_satellite, min_distance = self.closest_satellite_scalar(h)
+
+        if closest_satellite is None:
+            #empty constellation, nothing to send to yet
+            return None
+        log.debug("[%s] Closest satellite is at (%s, %s)", self.device_name, closest_satellite["device_name"], closest_satellite["addr"])
         
         speed_of_light = 299_792.458
         travel_time = min_distance / speed_of_light
         self.delay_message = travel_time
+        self.satellite_distance = min_distance
         #print(f"Simulating Travel Delay for {self.delay_message:.6f} seconds")
         #time.sleep(self.delay_message)
         
@@ -218,85 +260,135 @@ class WildLifeTracker:
         
         return distance
 
+    def next_batch(self):
+        #up to batch_size readings, waiting at most batch_interval ms after the first one
+        batch = [self.message_queue.get_nowait()]
+        deadline = time.monotonic() + self.batch_interval / 1000
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.message_queue.get(timeout=remaining))
+                else:
+                    batch.append(self.message_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def requeue(self, batch):
+        #readings taken from the queue but not acknowledged are sent again
+        if isinstance(self.message_queue, PersistentQueue):
+            self.message_queue.rewind()
+            return
+        for reading in batch:
+            reading["restored"] = True
+            self.message_queue.put(reading)
+            #the reading was counted as unfinished when first queued
+            self.message_queue.task_done()
+
     def sender_thread(self, secret_key):
         #print("sender")
 
+        #seconds before the next attempt, doubled after every failed one up to RETRY_MAX
+        retry = RETRY_MIN
         while True:
-
+            batch = []
             try:
                 
                 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
                     #Check if Marine Tracker is generating data, then relay to surface marine node due to radio waves being unable to work in water
                     #This is a future work, based on research, not actually implemented currently.
                     if self.device_name.startswith("MarineAnimalTrackerDevice"):
-                        print(f"[{self.device_name}] Relaying message through the closest node on the surface to LEO Satellites")
+                        log.info(f"[{self.device_name}] Relaying message through the closest node on the surface to LEO Satellites")
                     #finding closest satellite
                     closest_satellite = self.closest_satellite()
+                    if closest_satellite is None:
+                        log.warning(f"[{self.device_name}] No satellite visible, retrying in {retry} seconds...")
+                        self.clock.sleep(retry)
+                        retry = min(retry * 2, RETRY_MAX)
+                        continue
                     satellite_host, satellite_port = closest_satellite["addr"].split(":")
                     s.connect((satellite_host, int(satellite_port)))
                     self.source_ip, self.source_port = s.getsockname()
-                    print(
+                    log.info(
                         f"[{self.device_name}] Connected to satellite at {satellite_host}:{satellite_port}"
                     )
-                    print(
+                    log.info(
                         f"[{self.device_name}] Tracker IP: {self.source_ip}, Tracker Port: {self.source_port}"
                     )
 
                     queued_count = self.message_queue.qsize()
                     if queued_count > 0:
-                        print(
+                        log.info(
                             f"[{self.device_name}] {queued_count} data in message queue, will send them first"
                         )
                     while True:
 
                         try:
-                            data = self.message_queue.get_nowait()
-                            data["restored"] = queued_count > 0
+                            if self.batch_size > 1:
+                                #pack several readings into one encrypted frame
+                                batch = self.next_batch()
+                                for reading in batch:
+                                    reading["restored"] = reading.get("restored", False) or queued_count > 0
+                                    queued_count -= 1
+                                data = {"batch": batch}
+                            else:
+                                batch = [self.message_queue.get_nowait()]
+                                #seal adds the checksum, the queued reading stays as it was for a resend
+                                data = dict(batch[0])
+                                data["restored"] = data.get("restored", False) or queued_count > 0
+                                queued_count -= 1
                             #calculate checksum and encrypt
-                            checksum = self.calculate_checksum(data)
-                            data["checksum"] = checksum
-                            iv, tag, encrypted_data = self.encrypt_data(
-                                data, secret_key
+                            message = seal(data, secret_key, self.checksum)
+                            message["hops"] = start_trace(
+                                self.device_name, self.clock.time(), closest_satellite["device_name"], self.satellite_distance
                             )
-                            path = self.device_name
-                            message = {
-                                "iv": iv.hex(),
-                                "encrypted_data": encrypted_data.hex(),
-                                "tag": tag.hex(),
-                                "path": path,
-                            }
                             
-                            final_message = json.dumps(message)
-                            print(
-                                f"\n[{self.device_name}] Data to be sent to satellite: {json.dumps(data, indent=4)}"
+                            #the payload dump is only built when debug logging is on
+                            if log.isEnabledFor(logging.DEBUG):
+                                log.debug(f"[{self.device_name}] Data to be sent to satellite: {json.dumps(data, indent=4)}")
+                            log.debug("[%s] Simulating Message Travel Delay for %.6f seconds", self.device_name, self.delay_message)
+                            self.clock.sleep(self.delay_message)
+                            send_envelope(s, message)
+                            log.info(
+                                "[%s] Sent %d encrypted readings", self.device_name, len(batch),
+                                extra={"fields": {"readings_sent": len(batch)}},
                             )
-                            print(f"\nSimulating Message Travel Delay for {self.delay_message:.6f} seconds")
-                            time.sleep(self.delay_message)
-                            s.sendall(final_message.encode("utf-8"))
-                            print(f"\n[{self.device_name}] Sent encrypted data")
 
                             
-                            ack = s.recv(1024).decode("utf-8")
-                            if ack:
-                                print(
-                                    f"\n[{self.device_name}] Received acknowledgment: {ack}"
-                                )
-
-                            queued_count -= 1
-                            time.sleep(1)
+                            ack = recv_text(s)
+                            if ack is None:
+                                raise ConnectionError("Satellite closed the connection before acknowledging")
+                            log.debug("[%s] Received acknowledgment: %s", self.device_name, ack)
+                            #only acknowledged readings leave the queue for good
+                            for _ in batch:
+                                self.message_queue.task_done()
+                            READINGS_SENT.inc(len(batch))
+                            MESSAGES_SENT.inc()
+                            BYTES_SENT.inc(envelope_size(message))
+                            batch = []
+                            retry = RETRY_MIN
+
+                            #batches drain the backlog back to back
+                            if self.batch_size == 1:
+                                self.clock.sleep(1)
                         except queue.Empty:
-                            time.sleep(1)
+                            self.clock.sleep(1)
                             continue
-            except socket.error as e:
-                print(
-                    f"[{self.device_name}] Connection error: {e}, retrying in 5 seconds..."
+            #a malformed ack or an unsealable reading is a ValueError (ProtocolError)
+            except (OSError, ValueError) as e:
+                SEND_ERRORS.inc()
+                log.warning(
+                    f"[{self.device_name}] Connection error: {e}, retrying in {retry} seconds..."
                 )
-                time.sleep(5)
+                self.requeue(batch)
+                self.clock.sleep(retry)
+                retry = min(retry * 2, RETRY_MAX)
 
     def run(self):
         
-        print(f"[{self.device_name}] Starting data transmission to satellite")
-        print("Press Ctrl+C to stop\n")
+        log.info(f"[{self.device_name}] Starting data transmission to satellite")
+        log.info("Press Ctrl+C to stop\n")
 
         try:
             threading.Thread(
@@ -304,18 +396,16 @@ class WildLifeTracker:
             ).start()
 
             while True:
-                time.sleep(1)
+                self.clock.sleep(1)
                 if not (
                     self.source_ip and self.source_port
                 ):  
                     continue
                 
                 self.collect_data()
-                print(
-                    f"[{self.device_name}] Adding data to message queue, {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                )
-                time.sleep(5)
+                log.debug("[%s] Adding data to message queue", self.device_name)
+                self.clock.sleep(5)
         except KeyboardInterrupt:
-            print(f"[{self.device_name}] Stopping transmission")
+            log.info(f"[{self.device_name}] Stopping transmission")
         except Exception as e:
-            print(f"[{self.device_name}] Error in communication: {e}")
+            log.error(f"[{self.device_name}] Error in communication: {e}")
@@ -0,0 +1,176 @@
+import heapq
+import math
+import threading
+
+import numpy as np
+
+from utils.orbit import EARTH_RADIUS
+
+# Sub-linear nearest satellite queries for large constellations.
+#
+# Satellite positions at a time slice are stored as ECEF unit vectors in a
+# KD-tree. The straight-line (chord) distance between unit vectors orders
+# points exactly like the great-circle distance used by haversine, so the
+# tree answers the same nearest neighbour question as the linear scan.
+
+
+def unit_vectors(lat, long):
+    lat, long = np.radians(lat), np.radians(long)
+    cos_lat = np.cos(lat)
+    return np.stack((cos_lat * np.cos(long), cos_lat * np.sin(long), np.sin(lat)), axis=-1)
+
+
+def chord_to_surface(chord):
+    return 2 * EARTH_RADIUS * math.asin(min(chord / 2, 1.0))
+
+
+def surface_to_chord(distance):
+    return 2 * math.sin(min(distance / EARTH_RADIUS, math.pi) / 2)
+
+
+class KDTree:
+
+    def __init__(self, points, leaf_size=16):
+        self.points = np.asarray(points, dtype=float)
+        self.leaf_size = leaf_size
+        self.order = np.arange(len(self.points))
+        #node = (lo, hi, split dim or -1 for a leaf, split value, left, right)
+        self.nodes = []
+        if len(self.points):
+            self.build(0, len(self.points))
+        self.sorted_points = self.points[self.order]
+
+    def __len__(self):
+        return len(self.points)
+
+    def build(self, lo, hi):
+        node = len(self.nodes)
+        self.nodes.append(None)
+        if hi - lo <= self.leaf_size:
+            self.nodes[node] = (lo, hi, -1, 0.0, -1, -1)
+            return node
+
+        idx = self.order[lo:hi]
+        pts = self.points[idx]
+        dim = int(np.argmax(pts.max(axis=0) - pts.min(axis=0)))
+        mid = (hi - lo) // 2
+        self.order[lo:hi] = idx[np.argpartition(pts[:, dim], mid)]
+        split = float(self.points[self.order[lo + mid], dim])
+
+        left = self.build(lo, lo + mid)
+        right = self.build(lo + mid, hi)
+        self.nodes[node] = (lo, hi, dim, split, left, right)
+        return node
+
+    def leaves(self):
+        #index arrays of the points in each leaf, nearby points together
+        return [self.order[lo:hi] for lo, hi, dim, _, _, _ in self.nodes if dim < 0]
+
+    def query(self, point, k=1, exclude=()):
+        #k nearest (chord distance, index) pairs sorted by distance, skipping indices in exclude
+        if not self.nodes or k <= 0:
+            return []
+        point = np.asarray(point, dtype=float)
+        best = []  #max-heap of (-squared distance, index)
+        stack = [(0, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if len(best) == k and bound >= -best[0][0]:
+                continue
+            lo, hi, dim, split, left, right = self.nodes[node]
+            if dim < 0:
+                d2 = ((self.sorted_points[lo:hi] - point) ** 2).sum(axis=1)
+                worst = -best[0][0] if len(best) == k else math.inf
+                for j in np.nonzero(d2 < worst)[0]:
+                    i = int(self.order[lo + j])
+                    if i in exclude:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-float(d2[j]), i))
+                    elif d2[j] < -best[0][0]:
+                        heapq.heapreplace(best, (-float(d2[j]), i))
+                continue
+
+            diff = point[dim] - split
+            near, far = (left, right) if diff < 0 else (right, left)
+            stack.append((far, max(bound, diff * diff)))
+            stack.append((near, bound))
+
+        return [(math.sqrt(-d2), i) for d2, i in sorted(best, reverse=True)]
+
+    def query_radius(self, point, radius):
+        #array of the indices of all points within chord distance radius
+        if not self.nodes:
+            return np.empty(0, dtype=int)
+        point = np.asarray(point, dtype=float)
+        r2 = radius * radius
+        found = []
+        stack = [0]
+        while stack:
+            lo, hi, dim, split, left, right = self.nodes[stack.pop()]
+            if dim < 0:
+                d2 = ((self.sorted_points[lo:hi] - point) ** 2).sum(axis=1)
+                found.append(self.order[lo:hi][d2 <= r2])
+                continue
+            diff = point[dim] - split
+            if diff - radius < 0:
+                stack.append(left)
+            if diff + radius >= 0:
+                stack.append(right)
+        return np.concatenate(found) if found else np.empty(0, dtype=int)
+
+
+class ConstellationIndex:
+    # KD-tree of the constellation at one time slice. Positions are rebuilt
+    # when a query falls outside the current slice, so queries inside a slice
+    # use positions up to slice_seconds old.
+
+    def __init__(self, orbits, slice_seconds=1.0, leaf_size=16):
+        self.orbits = orbits
+        self.slice_seconds = slice_seconds
+        self.leaf_size = leaf_size
+        self.built_at = None
+        self.tree = None
+        self.lock = threading.Lock()
+
+    def refresh(self, t):
+        with self.lock:
+            if self.built_at is None or abs(t - self.built_at) >= self.slice_seconds:
+                lat, long = self.orbits.positions(t)
+                self.tree = KDTree(unit_vectors(lat, long), self.leaf_size)
+                self.built_at = t
+            return self.tree
+
+    def excluded(self, names):
+        return {i for name in names for i in self.orbits.index_by_name.get(name, [])}
+
+    def nearest(self, lat, long, t, h=None, k=1, exclude=()):
+        #k nearest satellites as (index, distance) pairs, 3D distance when h (km) is given
+        tree = self.refresh(t)
+        point = unit_vectors(lat, long)
+        skip = self.excluded(exclude)
+        available = len(tree) - len(skip)
+        if available <= 0:
+            return []
+        k = min(k, available)
+
+        if h is None:
+            return [(i, chord_to_surface(c)) for c, i in tree.query(point, k, skip)]
+
+        #altitudes differ, so surface order is only a lower bound on 3D order:
+        #widen the search until no unseen satellite can beat the k-th best
+        min_dh = float(np.min(np.abs(self.orbits.altitude - h)))
+        n = k
+        while True:
+            found = tree.query(point, n, skip)
+            ranked = sorted(
+                (math.sqrt(chord_to_surface(c) ** 2 + (self.orbits.altitude[i] - h) ** 2), i)
+                for c, i in found
+            )[:k]
+            if len(found) == available:
+                break
+            bound = math.sqrt(chord_to_surface(found[-1][0]) ** 2 + min_dh ** 2)
+            if bound >= ranked[-1][0]:
+                break
+            n *= 2
+        return [(i, d) for d, i in ranked]
@@ -0,0 +1,104 @@
+import threading
+from collections import deque
+
+from utils.persistent_queue import PersistentQueue
+
+
+class StoreAndForwardBuffer:
+    # Onboard buffer for relayed messages that could not be handed over.
+    #
+    # Messages are kept in memory, up to max_items. When spill_dir is given,
+    # messages that do not fit in memory go to a PersistentQueue there (and
+    # survive a restart); otherwise the oldest buffered message is dropped to
+    # make room. Order is first in, first out across both.
+    #
+    # A flusher take()s the oldest message, tries to deliver it and then calls
+    # delivered() or retry(). Only one message is taken at a time. On close()
+    # the messages in memory are written to the spill queue, behind any
+    # already there, so with spill_dir nothing buffered is lost on shutdown.
+
+    def __init__(self, max_items=1000, spill_dir=None, spill_max_items=100000):
+        self.max_items = max_items
+        self.memory = deque()
+        self.spill = None
+        if spill_dir is not None:
+            self.spill = PersistentQueue(spill_dir, spill_max_items, "drop_oldest")
+        self.taken = None
+        self.taken_from_spill = False
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def put(self, message):
+        #relays pass views into their read buffer, keep a copy of the payload
+        message = {"hops": message["hops"], "payload": bytes(message["payload"])}
+        with self.lock:
+            if self.spill is not None and (len(self.memory) >= self.max_items or not self.spill.empty()):
+                #newer than everything in memory, so it goes behind the spilled messages
+                self.spill.put({"hops": message["hops"], "payload": message["payload"].hex()})
+            else:
+                if len(self.memory) >= self.max_items:
+                    self.memory.popleft()
+                    self.dropped += 1
+                self.memory.append(message)
+
+    def take(self):
+        #oldest buffered message, None if there is nothing to flush
+        with self.lock:
+            if self.taken is not None:
+                raise RuntimeError("take() called before the previous message was settled")
+            if self.memory:
+                self.taken = self.memory.popleft()
+                self.taken_from_spill = False
+            elif self.spill is not None and not self.spill.empty():
+                item = self.spill.get_nowait()
+                self.taken = {"hops": item["hops"], "payload": bytes.fromhex(item["payload"])}
+                self.taken_from_spill = True
+            return self.taken
+
+    def delivered(self):
+        with self.lock:
+            if self.taken_from_spill:
+                self.spill.task_done()
+            self.taken = None
+
+    def retry(self):
+        #put the taken message back in front
+        with self.lock:
+            if self.taken_from_spill:
+                self.spill.rewind()
+            else:
+                self.memory.appendleft(self.taken)
+            self.taken = None
+
+    def flush(self, send):
+        #deliver buffered messages in order until send raises, returns how many were sent
+        sent = 0
+        while True:
+            message = self.take()
+            if message is None:
+                return sent
+            try:
+                send(message)
+            except Exception:
+                self.retry()
+                raise
+            self.delivered()
+            sent += 1
+
+    def qsize(self):
+        with self.lock:
+            size = len(self.memory) + (self.taken is not None)
+            if self.spill is not None:
+                size += self.spill.qsize()
+            return size
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def close(self):
+        if self.spill is not None:
+            with self.lock:
+                while self.memory:
+                    message = self.memory.popleft()
+                    self.spill.put({"hops": message["hops"], "payload": message["payload"].hex()})
+            self.spill.close()
@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import threading
+import time
+
+from utils.log import get_logger
+
+log = get_logger("telemetry_store")
+
+# Typed storage for readings received by the ground station.
+#
+# Rows are collected in memory and written by one background thread in a
+# single transaction per batch, when batch_size rows are waiting or
+# flush_interval seconds have passed. The database runs in WAL mode, so
+# queries can read it while the ground station keeps writing.
+
+COLUMNS = (
+    "device", "message_order", "timestamp", "received_at", "latitude", "longitude",
+    "heart_rate", "body_temperature", "height", "depth", "path", "latency", "restored",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY,
+    device TEXT NOT NULL,
+    message_order INTEGER,
+    timestamp REAL,
+    received_at REAL,
+    latitude REAL,
+    longitude REAL,
+    heart_rate REAL,
+    body_temperature REAL,
+    height REAL,
+    depth REAL,
+    path TEXT,
+    latency REAL,
+    restored INTEGER
+);
+CREATE INDEX IF NOT EXISTS readings_device_time ON readings (device, timestamp);
+"""
+
+
+class TelemetryStore:
+
+    def __init__(self, path, batch_size=500, flush_interval=1.0, max_pending=50000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self.pending = []
+        self.written = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.drained = threading.Condition(self.lock)
+        self.running = True
+        self.flush_requested = False
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        #sqlite connections belong to the thread that opened them
+        self.ready = threading.Event()
+        self.error = None
+        self.writer = threading.Thread(target=self.run, daemon=True)
+        self.writer.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+
+    def connect(self):
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SCHEMA)
+        return db
+
+    def add(self, record, path, received_at):
+        #queue one decrypted reading, waits while max_pending rows are not yet written
+        row = (
+            record.get("device_name"),
+            record.get("Message Order"),
+            record.get("timestamp"),
+            received_at,
+            record.get("latitude"),
+            record.get("longitude"),
+            record.get("heart_rate"),
+            record.get("body_temperature"),
+            record.get("height"),
+            record.get("depth"),
+            path,
+            received_at - record["timestamp"] if "timestamp" in record else None,
+            int(bool(record.get("restored", False))),
+        )
+        with self.lock:
+            self.drained.wait_for(lambda: len(self.pending) < self.max_pending or not self.running)
+            self.pending.append(row)
+            if len(self.pending) >= self.batch_size:
+                self.wakeup.notify()
+
+    def run(self):
+        try:
+            db = self.connect()
+        except sqlite3.Error as e:
+            self.error = e
+            self.ready.set()
+            return
+        self.ready.set()
+
+        insert = f"INSERT INTO readings ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        last_flush = time.monotonic()
+        while True:
+            with self.lock:
+                self.wakeup.wait_for(
+                    lambda: len(self.pending) >= self.batch_size or self.flush_requested or not self.running,
+                    max(0.0, last_flush + self.flush_interval - time.monotonic()),
+                )
+                rows, self.pending = self.pending, []
+                self.flush_requested = False
+                running = self.running
+            if rows:
+                try:
+                    with db:
+                        db.executemany(insert, rows)
+                except sqlite3.Error as e:
+                    log.error(f"[Telemetry Store] Failed to write {len(rows)} readings: {e}")
+            with self.lock:
+                self.written += len(rows)
+                self.drained.notify_all()
+            last_flush = time.monotonic()
+            if not running:
+                break
+        db.close()
+
+    def flush(self, timeout=None):
+        #wait until everything added so far is written
+        with self.lock:
+            target = self.written + len(self.pending)
+            self.flush_requested = True
+            self.wakeup.notify()
+            return self.drained.wait_for(lambda: self.written >= target, timeout)
+
+    def close(self):
+        with self.lock:
+            self.running = False
+            self.wakeup.notify()
+            self.drained.notify_all()
+        self.writer.join()
@@ -0,0 +1,146 @@
+import threading
+
+from utils import metrics
+from utils.log import get_logger
+
+log = get_logger("trace")
+
+# Per-hop trace records carried in the route header of an envelope (see
+# utils/protocol.py).
+#
+# Every node a message passes appends one record
+#
+#   [node, arrived, departed, next_hop, distance_km]
+#
+# The tracker's record has no arrival, a relay fills in its departure, next hop
+# and distance when it hands the message over (again if the message waited in
+# its store-and-forward buffer). On the wire the records are packed binary,
+# about 30 bytes a hop. Each node stamps its own clock, so on separate machines
+# link latencies are only as good as their clock sync.
+
+NODE, ARRIVED, DEPARTED, NEXT_HOP, DISTANCE = range(5)
+GROUND_STATION = "Ground Station"
+
+RESIDENCE = metrics.histogram(
+    "ground_station_hop_residence_seconds", "Time messages spent at a satellite, from arrival to departure", ["node"]
+)
+LINK_LATENCY = metrics.histogram(
+    "ground_station_link_latency_seconds", "From departing the previous node to arriving at this one", ["node"]
+)
+
+
+def start_trace(node, departed, next_hop=None, distance_km=None):
+    return [[node, None, departed, next_hop, distance_km]]
+
+
+def arrive(hops, node, t):
+    hops.append([node, t, None, None, None])
+
+
+def depart(hops, t, next_hop, distance_km):
+    #set on every handover attempt, the last one is the one that got through
+    hops[-1][DEPARTED:] = [t, next_hop, distance_km]
+
+
+def visited(hops):
+    return {hop[NODE] for hop in hops}
+
+
+def path_string(hops, end=None):
+    #"Tracker-->Satellite-->..." for logs and the telemetry store
+    nodes = [hop[NODE] for hop in hops]
+    if end is not None:
+        nodes.append(end)
+    return "-->".join(nodes)
+
+
+def relays(hops):
+    #satellites a message passed, the first record is the tracker's
+    return max(0, len(hops) - 1)
+
+
+def hop_timings(hops, received):
+    #(node, residence, link latency into the node) for every node after the tracker,
+    #the ground station last; None where a timestamp is missing
+    timings = []
+    for previous, hop in zip(hops, hops[1:]):
+        link = None if previous[DEPARTED] is None else hop[ARRIVED] - previous[DEPARTED]
+        residence = None if hop[DEPARTED] is None else hop[DEPARTED] - hop[ARRIVED]
+        timings.append((hop[NODE], residence, link))
+    if hops and hops[-1][DEPARTED] is not None:
+        timings.append((GROUND_STATION, None, received - hops[-1][DEPARTED]))
+    return timings
+
+
+class HopStats:
+    # Per-node latency breakdown of the messages a ground station received:
+    # how long messages waited at each satellite and how long the link into
+    # it took. Also feeds the residence and link latency histograms, labelled
+    # by node, which only satellites and the ground station are, not trackers.
+
+    def __init__(self, report_interval=60.0, name="Ground Station"):
+        self.report_interval = report_interval
+        self.name = name
+        self.nodes = {}
+        self.last_report = None
+        self.lock = threading.Lock()
+
+    def add(self, hops, received):
+        timings = hop_timings(hops, received)
+        with self.lock:
+            for node, residence, link in timings:
+                stats = self.nodes.get(node)
+                if stats is None:
+                    stats = self.nodes[node] = {
+                        "messages": 0, "residences": 0, "residence": 0.0, "residence_max": 0.0, "links": 0, "link": 0.0,
+                    }
+                stats["messages"] += 1
+                #means are over the messages that had the timestamps, not all of them
+                if residence is not None:
+                    stats["residences"] += 1
+                    stats["residence"] += residence
+                    stats["residence_max"] = max(stats["residence_max"], residence)
+                if link is not None:
+                    stats["links"] += 1
+                    stats["link"] += link
+        for node, residence, link in timings:
+            if residence is not None:
+                RESIDENCE.labels(node).observe(residence)
+            if link is not None:
+                LINK_LATENCY.labels(node).observe(link)
+
+    def summary(self):
+        #{node: messages, mean residence, max residence, mean link latency into it},
+        #a mean is None when no message had the timestamps for it
+        with self.lock:
+            return {
+                node: {
+                    "messages": stats["messages"],
+                    "residence_mean": stats["residence"] / stats["residences"] if stats["residences"] else None,
+                    "residence_max": stats["residence_max"],
+                    "link_mean": stats["link"] / stats["links"] if stats["links"] else None,
+                }
+                for node, stats in self.nodes.items()
+            }
+
+    def maybe_report(self, now):
+        #log the breakdown at most every report_interval seconds
+        if self.last_report is None:
+            self.last_report = now
+        elif now - self.last_report >= self.report_interval:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        summary = self.summary()
+        def seconds(value):
+            return "-" if value is None else f"{value:.3f} s"
+
+        for node in sorted(summary, key=lambda n: -(summary[n]["residence_mean"] or 0) - (summary[n]["link_mean"] or 0)):
+            stats = summary[node]
+            log.info(
+                "[%s] %s: %d messages, residence mean %s max %.3f s, link in mean %s",
+                self.name, node, stats["messages"], seconds(stats["residence_mean"]), stats["residence_max"],
+                seconds(stats["link_mean"]),
+                extra={"fields": dict(stats, node=node)},
+            )